@@ -1,52 +1,63 @@
 from dataclasses import asdict
-from io import StringIO
+from functools import partial
+import html
+import io
 import json
 import os
 import streamlit as st
 
 from data_driven_characters.character import generate_character_definition, Character
-from data_driven_characters.corpus import (
-    generate_corpus_summaries,
-    generate_docs,
-)
+from data_driven_characters.constants import OUTPUT_ROOT
+from data_driven_characters.corpus import get_corpus_summaries, iter_docs
 from data_driven_characters.chatbots import (
     SummaryChatBot,
     RetrievalChatBot,
     SummaryRetrievalChatBot,
 )
+from data_driven_characters.clients import get_embeddings
+from data_driven_characters.index import load_corpus_vectorstore
 from data_driven_characters.interfaces import reset_chat, clear_user_input, converse
+from data_driven_characters.memory import TurnWriter
+
+CORPUS_PREVIEW_BYTES = 10_000
 
 
 @st.cache_resource()
-def create_chatbot(character_definition, corpus_summaries, chatbot_type):
+def create_chatbot_factory(character_definition, corpus_summaries, chatbot_type):
+    """Return a function that creates a chatbot with its own memory.
+
+    The retrieval index is built once and shared by the chatbots of every session.
+    """
     if chatbot_type == "summary":
-        chatbot = SummaryChatBot(character_definition=character_definition)
+        return partial(SummaryChatBot, character_definition=character_definition)
     elif chatbot_type == "retrieval":
-        chatbot = RetrievalChatBot(
-            character_definition=character_definition,
-            documents=corpus_summaries,
-        )
+        chatbot_class = RetrievalChatBot
     elif chatbot_type == "summary with retrieval":
-        chatbot = SummaryRetrievalChatBot(
-            character_definition=character_definition,
-            documents=corpus_summaries,
-        )
+        chatbot_class = SummaryRetrievalChatBot
     else:
         raise ValueError(f"Unknown chatbot type: {chatbot_type}")
-    return chatbot
+    embeddings = get_embeddings()
+    return partial(
+        chatbot_class,
+        character_definition=character_definition,
+        documents=corpus_summaries,
+        corpus_vectorstore=load_corpus_vectorstore(corpus_summaries, embeddings),
+        embeddings=embeddings,
+        turn_writer=TurnWriter(embeddings),
+    )
 
 
 @st.cache_data(persist="disk")
-def process_corpus(corpus):
-    # load docs
-    docs = generate_docs(
-        corpus=corpus,
-        chunk_size=2048,
-        chunk_overlap=64,
+def process_corpus(corpus_name, corpus):
+    # stream the chunks of the uploaded bytes into summarization
+    docs = iter_docs(io.BytesIO(corpus), chunk_size=2048, chunk_overlap=64)
+
+    # generate summaries, cached per chunk across uploads
+    corpus_summaries = get_corpus_summaries(
+        docs=docs,
+        summary_type="map_reduce",
+        cache_dir=f"{OUTPUT_ROOT}/{corpus_name}/summarytype_map_reduce/summaries",
     )
-
-    # generate summaries
-    corpus_summaries = generate_corpus_summaries(docs=docs, summary_type="map_reduce")
     return corpus_summaries
 
 
@@ -77,14 +88,16 @@ def main():
             corpus_name = os.path.splitext(os.path.basename(uploaded_file.name))[0]
 
             # read file
-            stringio = StringIO(uploaded_file.getvalue().decode("utf-8"))
-            corpus = stringio.read()
+            corpus = uploaded_file.getvalue()
 
-            # scrollable text
+            # scrollable text, previewing the start of the corpus
+            preview = corpus[:CORPUS_PREVIEW_BYTES].decode("utf-8", errors="ignore")
+            if len(corpus) > CORPUS_PREVIEW_BYTES:
+                preview += "..."
             st.markdown(
                 f"""
                 <div style='overflow: auto; height: 200px; border: 1px solid gray; border-radius: 5px; padding: 10px'>
-                    {corpus}</div>
+                    {html.escape(preview)}</div>
                 """,
                 unsafe_allow_html=True,
             )
@@ -111,7 +124,7 @@ def main():
                 st.session_state["character_name"] = character_name
 
                 with st.spinner("Processing corpus (this will take a while)..."):
-                    corpus_summaries = process_corpus(corpus)
+                    corpus_summaries = process_corpus(corpus_name, corpus)
 
                 with st.spinner("Generating character definition..."):
                     # get character definition
@@ -142,12 +155,20 @@ def main():
 
     if uploaded_file is not None and character_name:
         st.divider()
-        chatbot = create_chatbot(
+        # share the character and index across sessions, but give each session
+        # its own memory, which reset_chat discards
+        create_chatbot = create_chatbot_factory(
             character_definition=Character(**character_definition),
             corpus_summaries=corpus_summaries,
             chatbot_type=chatbot_type,
         )
-        converse(chatbot)
+        if (
+            "chatbot" not in st.session_state
+            or st.session_state.get("create_chatbot") is not create_chatbot
+        ):
+            st.session_state["create_chatbot"] = create_chatbot
+            st.session_state["chatbot"] = create_chatbot()
+        converse(st.session_state["chatbot"])
 
 
 if __name__ == "__main__":
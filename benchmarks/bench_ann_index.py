@@ -0,0 +1,86 @@
+"""Compare the latency, memory and recall@k of the index types against flat search.
+
+Vectors are drawn around random cluster centers, like the chunks of scenes,
+and queries are noisy copies of random vectors. Memory is the size of the
+serialized index.
+
+Example:
+    python benchmarks/bench_ann_index.py --num_vectors 1000 10000 50000 --k 10
+"""
+
+import argparse
+import statistics
+import time
+
+import faiss
+import numpy as np
+
+from data_driven_characters.index import (
+    EMBEDDING_DIM,
+    INDEX_TYPES,
+    create_index,
+    get_index_description,
+)
+
+
+def make_vectors(num_vectors, dim, num_clusters, seed=0):
+    """Synthetic vectors scattered around num_clusters random centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(num_clusters, size=num_vectors)]
+    return vectors + 0.5 * rng.standard_normal(vectors.shape, dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_vectors", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--index_types", type=str, nargs="+", default=INDEX_TYPES)
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(
+        f"{'vectors':>8} {'index':<6} {'description':<14} {'build s':>8} "
+        f"{'MB':>8} {'mean ms':>8} {'p95 ms':>8} {'recall@k':>9}"
+    )
+    for num_vectors in args.num_vectors:
+        vectors = make_vectors(num_vectors, args.dim, max(1, num_vectors // 100))
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(num_vectors, size=args.num_queries)]
+        queries = queries + 0.5 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+        expected = None
+        for index_type in ["flat"] + [t for t in args.index_types if t != "flat"]:
+            start = time.perf_counter()
+            index = create_index(index_type, args.dim, vectors)
+            index.add(vectors)
+            build_seconds = time.perf_counter() - start
+            megabytes = faiss.serialize_index(index).nbytes / 2**20
+
+            latencies = []
+            found = []
+            for query in queries:
+                start = time.perf_counter()
+                _, ids = index.search(query[None], args.k)
+                latencies.append(time.perf_counter() - start)
+                found.append(set(ids[0].tolist()))
+            if expected is None:
+                expected = found
+            recall = statistics.mean(
+                len(f & e) / len(e) for f, e in zip(found, expected)
+            )
+            print(
+                f"{num_vectors:>8} {index_type:<6} "
+                f"{get_index_description(index_type, args.dim, num_vectors):<14} "
+                f"{build_seconds:>8.2f} {megabytes:>8.1f} "
+                f"{1000 * statistics.mean(latencies):>8.3f} "
+                f"{1000 * statistics.quantiles(latencies, n=20)[-1]:>8.3f} "
+                f"{recall:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Measure the cost of generating a character definition with a fake LLM.
+
+Uses the map_reduce summaries bundled in output/ for each corpus. The fake LLM
+answers each description and revision prompt with the requested number of
+characters off by --length_error, so description fitting takes as many rounds
+as it would with a model that misses the length by that much. Reports the
+wall time, the LLM calls and tokens, and the attempts spent fitting the short
+and long descriptions.
+
+Example:
+    python benchmarks/bench_character_definition.py --llm_latency 1.0 --length_error 0.3
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from data_driven_characters import tracing
+from data_driven_characters.character import generate_character_definition
+
+from corpora import load_bundled_summaries
+from fakes import install_fakes
+
+
+class SpanCollector(tracing.SpanExporter):
+    """Keep every finished span."""
+
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpora", type=str, default="data/*.txt")
+    parser.add_argument("--name", type=str, default="Protagonist")
+    parser.add_argument("--llm_latency", type=float, default=1.0)
+    parser.add_argument("--llm_latency_per_word", type=float, default=0.0)
+    parser.add_argument("--length_error", type=float, default=0.3)
+    args = parser.parse_args()
+
+    install_fakes(
+        llm_latency=args.llm_latency,
+        llm_latency_per_word=args.llm_latency_per_word,
+        length_error=args.length_error,
+    )
+    print(
+        f"{'corpus':<38} {'summaries':>10} {'LLM calls':>10} {'tokens in':>10} "
+        f"{'tokens out':>11} {'short tries':>12} {'long tries':>11} {'seconds':>8}"
+    )
+    for corpus_path in sorted(glob.glob(args.corpora)):
+        summaries = load_bundled_summaries(corpus_path)
+        if not summaries:
+            continue
+        collector = SpanCollector()
+        tracing.set_exporters([collector])
+        start = time.perf_counter()
+        generate_character_definition(args.name, summaries)
+        seconds = time.perf_counter() - start
+        tracing.set_exporters([])
+
+        llm_calls = [span for span in collector.spans if span.name == "llm_call"]
+        attempts = {
+            span.attributes["char_limit"]: span.attributes["num_attempts"]
+            for span in collector.spans
+            if span.name == "description_fitting"
+        }
+        print(
+            f"{os.path.basename(corpus_path):<38} {len(summaries):>10} "
+            f"{len(llm_calls):>10} "
+            f"{sum(span.attributes['tokens_in'] for span in llm_calls):>10} "
+            f"{sum(span.attributes['tokens_out'] for span in llm_calls):>11} "
+            f"{attempts[min(attempts)]:>12} {attempts[max(attempts)]:>11} "
+            f"{seconds:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Measure the per-turn latency of each chatbot with a fake LLM and fake embeddings.
+
+Each chatbot is built for the character bundled with each corpus and replays
+--num_turns deterministic messages. Reports the time to build the chatbot,
+the median and 95th percentile turn latency, and the mean time per turn
+spent in retrieval, prompt rendering and the LLM call.
+
+Example:
+    python benchmarks/bench_chat_latency.py --num_turns 20 --llm_latency 0.3 --embedding_latency 0.05
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import time
+
+from data_driven_characters import tracing
+from data_driven_characters.chatbots import (
+    RetrievalChatBot,
+    SummaryChatBot,
+    SummaryRetrievalChatBot,
+)
+from data_driven_characters.chunking import get_tokenized_corpus
+
+from corpora import load_bundled_character, load_bundled_summaries
+from fakes import fake_text, install_fakes
+
+CHATBOTS = {
+    "summary": SummaryChatBot,
+    "retrieval": RetrievalChatBot,
+    "summary_retrieval": SummaryRetrievalChatBot,
+}
+STAGES = ["retrieval", "prompt_render", "llm_call"]
+
+
+def create_chatbot(chatbot_type, character_definition, documents, args):
+    if chatbot_type == "summary":
+        return SummaryChatBot(
+            character_definition, max_history_tokens=args.max_history_tokens
+        )
+    return CHATBOTS[chatbot_type](
+        character_definition,
+        documents,
+        max_history_tokens=args.max_history_tokens,
+        max_context_tokens=args.max_context_tokens,
+        index_type=args.index_type,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpora", type=str, default="data/*.txt")
+    parser.add_argument(
+        "--chatbot_types", nargs="+", default=list(CHATBOTS), choices=list(CHATBOTS)
+    )
+    parser.add_argument(
+        "--retrieval_docs",
+        type=str,
+        default="summarized",
+        choices=["raw", "summarized"],
+    )
+    parser.add_argument("--num_turns", type=int, default=20)
+    parser.add_argument("--words_per_turn", type=int, default=15)
+    parser.add_argument("--max_history_tokens", type=int, default=None)
+    parser.add_argument("--max_context_tokens", type=int, default=None)
+    parser.add_argument("--index_type", type=str, default="flat")
+    parser.add_argument("--llm_latency", type=float, default=0.3)
+    parser.add_argument("--llm_latency_per_word", type=float, default=0.005)
+    parser.add_argument("--embedding_latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(
+        f"{'corpus':<38} {'chatbot':<18} {'build s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} " + " ".join(f"{stage + ' ms':>16}" for stage in STAGES)
+    )
+    for corpus_path in sorted(glob.glob(args.corpora)):
+        character_definition = load_bundled_character(corpus_path)
+        if character_definition is None:
+            continue
+        if args.retrieval_docs == "raw":
+            chunk_docs = get_tokenized_corpus(corpus_path).docs(256, 16)
+            documents = [doc.page_content for doc in chunk_docs]
+        else:
+            documents = load_bundled_summaries(corpus_path)
+
+        for chatbot_type in args.chatbot_types:
+            # fresh clients, so that no chatbot starts with warm caches
+            install_fakes(
+                llm_latency=args.llm_latency,
+                llm_latency_per_word=args.llm_latency_per_word,
+                embedding_latency=args.embedding_latency,
+            )
+            start = time.perf_counter()
+            chatbot = create_chatbot(
+                chatbot_type, character_definition, documents, args
+            )
+            build_seconds = time.perf_counter() - start
+
+            totals = tracing.StageTotals()
+            tracing.set_exporters([totals])
+            latencies = []
+            for i in range(args.num_turns):
+                message = fake_text(f"message {i}", args.words_per_turn)
+                start = time.perf_counter()
+                chatbot.step(message)
+                latencies.append(time.perf_counter() - start)
+            tracing.set_exporters([])
+
+            stages = totals.as_dict()
+            latencies.sort()
+            print(
+                f"{os.path.basename(corpus_path):<38} {chatbot_type:<18} "
+                f"{build_seconds:>8.2f} "
+                f"{1000 * statistics.median(latencies):>8.1f} "
+                f"{1000 * latencies[int(0.95 * (len(latencies) - 1))]:>8.1f} "
+                + " ".join(
+                    f"{1000 * stages.get(stage, {}).get('seconds', 0) / args.num_turns:>16.1f}"
+                    for stage in STAGES
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure the throughput of tokenizing and chunking the bundled corpora.
+
+Compares the TokenizedCorpus used by chat.py, which tokenizes a corpus once
+and then cuts every chunk layout from its token offsets, with iter_docs, which
+streams the file through the same chunker block by block, and with splitting
+the text with RecursiveCharacterTextSplitter for every layout, as the package
+did before. Reports the best of --repeats runs.
+
+Example:
+    python benchmarks/bench_chunking.py --corpora "data/*.txt" --repeats 3
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from data_driven_characters.chunking import TokenizedCorpus, iter_docs
+from data_driven_characters.utils import TOKEN_ENCODING
+
+LAYOUTS = [(2048, 64), (256, 16)]  # (chunk_size, chunk_overlap) of chat.py
+
+
+def split_text(text, chunk_size, chunk_overlap):
+    """Split text with a new tiktoken-backed RecursiveCharacterTextSplitter."""
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=TOKEN_ENCODING, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    return text_splitter.create_documents([text])
+
+
+def best_time(fn, repeats):
+    """The best wall time of repeats calls of fn, and its last result."""
+    seconds = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpora", type=str, default="data/*.txt")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'corpus':<38} {'method':<10} {'layout':>9} {'chunks':>7} "
+        f"{'ms':>8} {'MB/s':>7}"
+    )
+    for corpus_path in sorted(glob.glob(args.corpora)):
+        with open(corpus_path) as f:
+            text = f.read()
+        megabytes = len(text.encode()) / 1e6
+        name = os.path.basename(corpus_path)
+
+        seconds, corpus = best_time(lambda: TokenizedCorpus(text), args.repeats)
+        print(
+            f"{name:<38} {'tokenize':<10} {'':>9} {corpus.num_tokens:>7} "
+            f"{1000 * seconds:>8.1f} {megabytes / seconds:>7.2f}"
+        )
+        for chunk_size, chunk_overlap in LAYOUTS:
+            layout = f"{chunk_size}/{chunk_overlap}"
+            for method, split in [
+                ("offsets", lambda: corpus.docs(chunk_size, chunk_overlap)),
+                (
+                    "stream",
+                    lambda: list(iter_docs(corpus_path, chunk_size, chunk_overlap)),
+                ),
+                ("splitter", lambda: split_text(text, chunk_size, chunk_overlap)),
+            ]:
+                seconds, docs = best_time(split, args.repeats)
+                print(
+                    f"{name:<38} {method:<10} {layout:>9} {len(docs):>7} "
+                    f"{1000 * seconds:>8.1f} {megabytes / seconds:>7.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Replay a long synthetic conversation through unbounded and bounded memory.
+
+Example:
+    python benchmarks/bench_conversation_memory.py --num_turns 200 --max_history_tokens 1000
+"""
+
+import argparse
+import statistics
+import time
+
+from langchain.memory import ConversationBufferMemory
+
+from data_driven_characters.memory import BoundedConversationMemory
+from data_driven_characters.utils import count_tokens
+
+from fakes import FakeLLM, fake_text
+
+
+def replay(memory, num_turns, words_per_turn):
+    """Replay a conversation, recording history size and memory overhead per turn."""
+    history_tokens = []
+    overhead = []
+    for i in range(num_turns):
+        start = time.perf_counter()
+        history = memory.load_memory_variables({"input": ""})["chat_history"]
+        memory.save_context(
+            {"input": fake_text(f"human {i}", words_per_turn)},
+            {"response": fake_text(f"ai {i}", words_per_turn)},
+        )
+        overhead.append(time.perf_counter() - start)
+        history_tokens.append(count_tokens(history))
+    return history_tokens, overhead
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_turns", type=int, default=200)
+    parser.add_argument("--words_per_turn", type=int, default=40)
+    parser.add_argument("--max_history_tokens", type=int, default=1000)
+    parser.add_argument("--summary_latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    memories = {
+        "unbounded": ConversationBufferMemory(
+            memory_key="chat_history", input_key="input"
+        ),
+        "bounded": BoundedConversationMemory(
+            llm=FakeLLM(latency=args.summary_latency, num_words=100),
+            max_token_limit=args.max_history_tokens,
+            summary_token_limit=args.max_history_tokens // 4,
+            memory_key="chat_history",
+            input_key="input",
+        ),
+    }
+    print(
+        f"{'memory':<10} {'mean tokens':>12} {'max tokens':>11} "
+        f"{'final tokens':>13} {'mean ms/turn':>13} {'max ms/turn':>12}"
+    )
+    for name, memory in memories.items():
+        history_tokens, overhead = replay(memory, args.num_turns, args.words_per_turn)
+        print(
+            f"{name:<10} {statistics.mean(history_tokens):>12.0f} "
+            f"{max(history_tokens):>11} {history_tokens[-1]:>13} "
+            f"{1000 * statistics.mean(overhead):>13.2f} "
+            f"{1000 * max(overhead):>12.2f}"
+        )
+        if isinstance(memory, BoundedConversationMemory):
+            memory.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Compare flat search over every raw chunk with summary -> raw chunk drill-down.
+
+Parent chunks are random centers, their child chunks are scattered around them
+and each summary is the mean of its children plus noise. Queries are noisy
+copies of random children. Recall@k is measured against the flat search.
+
+Example:
+    python benchmarks/bench_hierarchical_retrieval.py --num_parents 500 --num_parents_searched 3
+"""
+
+import argparse
+import statistics
+import time
+
+import faiss
+import numpy as np
+
+from langchain.docstore import InMemoryDocstore
+from langchain.schema import Document
+from langchain.vectorstores import FAISS
+
+from data_driven_characters.context import search_with_vectors
+from data_driven_characters.hierarchy import HierarchicalVectorStore
+from data_driven_characters.index import EMBEDDING_DIM
+
+
+def make_vectorstore(vectors):
+    """A flat FAISS vectorstore whose i-th document is the string i."""
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    documents = {str(i): Document(page_content=str(i)) for i in range(len(vectors))}
+    return FAISS(None, index, InMemoryDocstore(documents), dict(enumerate(documents)))
+
+
+def make_corpus(num_parents, children_per_parent, dim, spread, seed=0):
+    """Synthetic summary and chunk vectors, and the children of every parent."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_parents, dim), dtype=np.float32)
+    chunks = np.repeat(centers, children_per_parent, axis=0)
+    chunks += spread * rng.standard_normal(chunks.shape, dtype=np.float32)
+    summaries = chunks.reshape(num_parents, children_per_parent, dim).mean(axis=1)
+    summaries += spread * rng.standard_normal(summaries.shape, dtype=np.float32)
+    children = [
+        list(range(i * children_per_parent, (i + 1) * children_per_parent))
+        for i in range(num_parents)
+    ]
+    return summaries, chunks, children
+
+
+def run(vectorstore, queries, k):
+    """Search every query, returning the ids found and the latency of each search."""
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        candidates = search_with_vectors(vectorstore, query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append({int(document.page_content) for document, _, _ in candidates})
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_parents", type=int, default=500, help="2048-token chunks"
+    )
+    parser.add_argument("--children_per_parent", type=int, default=9)
+    parser.add_argument("--num_parents_searched", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    summaries, chunks, children = make_corpus(
+        args.num_parents, args.children_per_parent, args.dim, args.spread
+    )
+    rng = np.random.default_rng(1)
+    queries = chunks[rng.integers(len(chunks), size=args.num_queries)]
+    queries = queries + args.spread * rng.standard_normal(queries.shape).astype(
+        np.float32
+    )
+
+    chunk_vectorstore = make_vectorstore(chunks)
+    vectorstores = {
+        "flat": chunk_vectorstore,
+        "hierarchical": HierarchicalVectorStore(
+            make_vectorstore(summaries),
+            chunk_vectorstore,
+            children,
+            args.num_parents_searched,
+        ),
+    }
+    print(
+        f"{len(summaries)} summaries, {len(chunks)} chunks, "
+        f"{args.num_queries} queries, k={args.k}"
+    )
+    print(f"{'search':<13} {'mean ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+    flat_results = None
+    for name, vectorstore in vectorstores.items():
+        results, latencies = run(vectorstore, queries, args.k)
+        if flat_results is None:
+            flat_results = results
+        recall = statistics.mean(
+            len(found & expected) / len(expected)
+            for found, expected in zip(results, flat_results)
+        )
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(
+            f"{name:<13} {1000 * statistics.mean(latencies):>8.3f} "
+            f"{1000 * p95:>8.3f} {recall:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare the per-chatbot f-string prompt with the precompiled character prompt.
+
+Measures the cost of building the prompt for a new chatbot, the cost of
+rendering it on every turn, and the prefix hit rate: the fraction of each
+turn's prompt, in characters, that is an unchanged prefix of the previous
+turn's prompt and can therefore be served from a provider's prompt cache.
+
+Example:
+    python benchmarks/bench_prompt_render.py --num_turns 50
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from langchain.prompts import PromptTemplate
+
+from data_driven_characters.character import Character
+from data_driven_characters.chatbots.prompts import get_character_prompt
+
+from fakes import fake_text
+
+
+def create_legacy_prompt(character_definition):
+    """The f-string prompt that SummaryRetrievalChatBot used to build per chatbot."""
+    return PromptTemplate.from_template(
+        f"""Your name is {character_definition.name}.
+Here is how you describe yourself:
+---
+{character_definition.long_description}
+---
+
+You will have a conversation with a Human, and you will engage in a dialogue with them.
+You will exaggerate your personality, interests, desires, emotions, and other traits.
+You will stay in character as {character_definition.name} throughout the conversation, even if the Human asks you questions that you don't know the answer to.
+You will not break character as {character_definition.name}.
+
+You are {character_definition.name} in the following story snippets, which describe events in your life.
+---
+{{context}}
+---
+
+Current conversation:
+---
+{character_definition.name}: {character_definition.greeting}
+{{chat_history}}
+---
+
+Human: {{input}}
+{character_definition.name}:"""
+    )
+
+
+def create_precompiled_prompt(character_definition):
+    return get_character_prompt(character_definition, context_key="context")
+
+
+def render(prompt, **inputs):
+    """Render a prompt into the text sent to the model."""
+    return "\n".join(
+        f"{message.type}: {message.content}"
+        for message in prompt.format_prompt(**inputs).to_messages()
+    )
+
+
+def common_prefix_length(a, b):
+    return len(os.path.commonprefix([a, b]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_turns", type=int, default=50)
+    parser.add_argument("--num_chatbots", type=int, default=200)
+    parser.add_argument("--description_words", type=int, default=400)
+    parser.add_argument("--context_words", type=int, default=300)
+    parser.add_argument("--words_per_turn", type=int, default=30)
+    args = parser.parse_args()
+
+    character_definition = Character(
+        name="Maverick",
+        short_description=fake_text("short", 30),
+        long_description=fake_text("long", args.description_words),
+        greeting=fake_text("greeting", 20),
+    )
+    print(f"{'prompt':<12} {'build us':>9} {'render us':>10} {'prefix hit rate':>16}")
+    for name, create_prompt in [
+        ("legacy", create_legacy_prompt),
+        ("precompiled", create_precompiled_prompt),
+    ]:
+        start = time.perf_counter()
+        for _ in range(args.num_chatbots):
+            prompt = create_prompt(character_definition)
+        build_seconds = (time.perf_counter() - start) / args.num_chatbots
+
+        render_seconds = []
+        hit_rates = []
+        history = []
+        previous = None
+        for i in range(args.num_turns):
+            inputs = dict(
+                context=fake_text(f"context {i}", args.context_words),
+                chat_history="\n".join(history),
+                input=fake_text(f"input {i}", args.words_per_turn),
+            )
+            start = time.perf_counter()
+            text = render(prompt, **inputs)
+            render_seconds.append(time.perf_counter() - start)
+            if previous is not None:
+                hit_rates.append(common_prefix_length(previous, text) / len(text))
+            previous = text
+            history.append(f"Human: {inputs['input']}")
+            history.append(f"Maverick: {fake_text(f'output {i}', args.words_per_turn)}")
+        print(
+            f"{name:<12} {1e6 * build_seconds:>9.1f} "
+            f"{1e6 * statistics.mean(render_seconds):>10.1f} "
+            f"{statistics.mean(hit_rates):>16.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
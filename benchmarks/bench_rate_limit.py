@@ -0,0 +1,91 @@
+"""Send bursts of chat requests to a fake endpoint that returns 429s beyond its quota.
+
+Compares a fixed concurrency limit, which relies on retries with backoff alone,
+with the AIMD adaptive limit, with and without the endpoint's requests per
+minute configured, reporting throughput, rejected requests, the
+limiter's throttle events and queue depth, and per-request latency.
+
+Example:
+    python benchmarks/bench_rate_limit.py --num_requests 200 --num_workers 32
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import time
+
+from data_driven_characters.clients import (
+    ClientRegistry,
+    LimitedChatOpenAI,
+    set_client_registry,
+)
+from data_driven_characters.rate_limit import RateLimiter
+
+from fakes import FakeChatCompletion
+
+
+def run(limiter, args):
+    """Send num_requests requests from num_workers threads through limiter."""
+    backend = FakeChatCompletion(
+        max_concurrency=args.server_concurrency,
+        requests_per_second=args.requests_per_second,
+        latency=args.latency,
+    )
+    registry = ClientRegistry()
+    registry.limiters["fake"] = limiter
+    set_client_registry(registry)
+    llm = LimitedChatOpenAI(
+        model_name="fake", openai_api_key="fake", max_retries=args.max_retries
+    )
+    llm.client = backend
+
+    def request(i):
+        start = time.perf_counter()
+        llm.predict(f"question {i}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+        latencies = list(executor.map(request, range(args.num_requests)))
+    seconds = time.perf_counter() - start
+    return backend, seconds, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_requests", type=int, default=200)
+    parser.add_argument("--num_workers", type=int, default=32)
+    parser.add_argument("--server_concurrency", type=int, default=4)
+    parser.add_argument("--requests_per_second", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max_retries", type=int, default=10)
+    args = parser.parse_args()
+
+    print(
+        f"{'limiter':<10} {'req/s':>7} {'429s':>6} {'throttles':>10} "
+        f"{'max queue':>10} {'limit':>6} {'p50 s':>7} {'p95 s':>7}"
+    )
+    for name, adaptive, requests_per_minute in [
+        ("fixed", False, None),
+        ("adaptive", True, None),
+        ("quota", True, 60 * args.requests_per_second),
+    ]:
+        limiter = RateLimiter(
+            max_concurrency=args.num_workers,
+            requests_per_minute=requests_per_minute,
+            adaptive=adaptive,
+        )
+        backend, seconds, latencies = run(limiter, args)
+        metrics = limiter.metrics()
+        latencies.sort()
+        print(
+            f"{name:<10} {args.num_requests / seconds:>7.1f} "
+            f"{backend.num_rejected:>6} {metrics['throttle_events']:>10} "
+            f"{metrics['max_queue_depth']:>10} {metrics['concurrency_limit']:>6} "
+            f"{statistics.median(latencies):>7.2f} "
+            f"{latencies[int(0.95 * (len(latencies) - 1))]:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
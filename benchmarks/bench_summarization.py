@@ -0,0 +1,67 @@
+"""Measure the wall time of summarizing the bundled corpora with a fake LLM.
+
+Every corpus is chunked as in the pipeline and summarized with each summary
+type into a temporary directory, first from scratch and then again from the
+summary cache. The fake LLM takes --llm_latency seconds per call plus
+--llm_latency_per_word per word of output, so the wall time shows how well
+the LLM calls overlap.
+
+Example:
+    python benchmarks/bench_summarization.py --llm_latency 0.5 --summary_types map_reduce refine
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+from data_driven_characters import tracing
+from data_driven_characters.corpus import get_corpus_summaries, load_docs
+
+from fakes import install_fakes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpora", type=str, default="data/*.txt")
+    parser.add_argument("--summary_types", nargs="+", default=["map_reduce", "refine"])
+    parser.add_argument("--chunk_size", type=int, default=2048)
+    parser.add_argument("--llm_latency", type=float, default=0.5)
+    parser.add_argument("--llm_latency_per_word", type=float, default=0.0)
+    args = parser.parse_args()
+
+    install_fakes(
+        llm_latency=args.llm_latency, llm_latency_per_word=args.llm_latency_per_word
+    )
+    print(
+        f"{'corpus':<38} {'summary type':<13} {'chunks':>7} {'LLM calls':>10} "
+        f"{'tokens in':>10} {'tokens out':>11} {'seconds':>8} {'cached s':>9}"
+    )
+    for corpus_path in sorted(glob.glob(args.corpora)):
+        docs = load_docs(corpus_path, chunk_size=args.chunk_size, chunk_overlap=64)
+        name = os.path.basename(corpus_path)
+        for summary_type in args.summary_types:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                totals = tracing.StageTotals()
+                tracing.set_exporters([totals])
+                start = time.perf_counter()
+                get_corpus_summaries(docs, summary_type, cache_dir)
+                seconds = time.perf_counter() - start
+                tracing.set_exporters([])
+
+                start = time.perf_counter()
+                get_corpus_summaries(docs, summary_type, cache_dir)
+                cached_seconds = time.perf_counter() - start
+            llm_calls = totals.as_dict().get("llm_call", {})
+            print(
+                f"{name:<38} {summary_type:<13} {len(docs):>7} "
+                f"{llm_calls.get('count', 0):>10.0f} "
+                f"{llm_calls.get('tokens_in', 0):>10.0f} "
+                f"{llm_calls.get('tokens_out', 0):>11.0f} "
+                f"{seconds:>8.2f} {cached_seconds:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import glob
+import json
+import os
+import re
+
+from data_driven_characters.character import Character
+from data_driven_characters.constants import OUTPUT_ROOT
+
+BUNDLED_OUTPUT_DIR = OUTPUT_ROOT + "/{corpus}/summarytype_map_reduce"
+
+
+def get_bundled_output_dir(corpus_path):
+    corpus = os.path.splitext(os.path.basename(corpus_path))[0]
+    return BUNDLED_OUTPUT_DIR.format(corpus=corpus)
+
+
+def load_bundled_summaries(corpus_path):
+    """The map_reduce summaries bundled with a corpus, in chunk order."""
+    paths = glob.glob(f"{get_bundled_output_dir(corpus_path)}/summaries/*.txt")
+    paths.sort(key=lambda path: int(re.search(r"\d+", os.path.basename(path))[0]))
+    summaries = []
+    for path in paths:
+        with open(path) as f:
+            summaries.append(f.read())
+    return summaries
+
+
+def load_bundled_character(corpus_path):
+    """The first character definition bundled with a corpus, or None."""
+    paths = sorted(
+        glob.glob(f"{get_bundled_output_dir(corpus_path)}/character_definitions/*.json")
+    )
+    if not paths:
+        return None
+    with open(paths[0]) as f:
+        return Character(**json.load(f))
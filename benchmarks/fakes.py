@@ -0,0 +1,199 @@
+import asyncio
+from collections import deque
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+
+from data_driven_characters.clients import ClientRegistry, set_client_registry
+from data_driven_characters.embeddings import CachedEmbeddings, HashingEmbeddings
+from data_driven_characters.llm_cache import set_response_cache
+
+WORDS = (
+    "the multiverse laundromat taxes kung fu bagel jump universe mother daughter "
+    "hammer god thunder love jet pilot mission danger canyon friend father rooster"
+).split()
+# e.g. "a 400-character description" or "contain 450 characters"
+LENGTH_PATTERN = re.compile(r"(\d+)[- ]characters?\b")
+
+
+def fake_text(seed, num_words):
+    """Deterministic pseudo-random text."""
+    rng = random.Random(hashlib.sha256(seed.encode()).digest())
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def fake_sentences(seed, num_chars):
+    """Deterministic pseudo-random sentences, cut to num_chars characters."""
+    rng = random.Random(hashlib.sha256(seed.encode()).digest())
+    sentences = []
+    length = 0
+    while length < num_chars:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 12))]
+        sentences.append(" ".join(words).capitalize() + ".")
+        length += len(sentences[-1]) + 1
+    return " ".join(sentences)[:num_chars].rstrip()
+
+
+class FakeLLM(LLM):
+    """An LLM that sleeps and returns text seeded by the prompt.
+
+    Each call takes latency seconds plus latency_per_word per word of output.
+    A prompt that asks for a number of characters, like the description and
+    revision prompts, is answered with that many characters off by
+    length_error, and any other prompt with num_words words.
+    """
+
+    latency: float = 0.0
+    latency_per_word: float = 0.0
+    num_words: int = 50
+    length_error: float = 0.2
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _respond(self, prompt):
+        lengths = LENGTH_PATTERN.findall(prompt)
+        if lengths:
+            num_chars = round(int(lengths[-1]) * (1 + self.length_error))
+            text = fake_sentences(prompt, num_chars)
+        else:
+            text = fake_text(prompt, self.num_words)
+        return text, self.latency + self.latency_per_word * len(text.split())
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> str:
+        text, latency = self._respond(prompt)
+        time.sleep(latency)
+        return text
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> str:
+        text, latency = self._respond(prompt)
+        await asyncio.sleep(latency)
+        return text
+
+
+class FakeEmbeddings(HashingEmbeddings):
+    """Hashing embeddings with a latency.
+
+    Each request takes latency seconds plus latency_per_text per text.
+    """
+
+    def __init__(self, latency=0.0, latency_per_text=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.latency_per_text * len(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        time.sleep(self.latency + self.latency_per_text)
+        return super().embed_query(text)
+
+
+def install_fakes(
+    llm_latency=0.0,
+    llm_latency_per_word=0.0,
+    embedding_latency=0.0,
+    embedding_latency_per_text=0.0,
+    length_error=0.2,
+):
+    """Serve every LLM and embedding client of the package with fakes.
+
+    The LLM response cache is turned off, so that fake responses are neither
+    stored nor replayed, and embeddings are cached in memory as by default.
+    """
+    set_response_cache(None)
+    set_client_registry(
+        ClientRegistry(
+            llm_factory=lambda model_name, **kwargs: FakeLLM(
+                latency=llm_latency,
+                latency_per_word=llm_latency_per_word,
+                length_error=length_error,
+            ),
+            embeddings_factory=lambda backend, cache_path: CachedEmbeddings(
+                FakeEmbeddings(
+                    latency=embedding_latency,
+                    latency_per_text=embedding_latency_per_text,
+                )
+            ),
+        )
+    )
+
+
+class FakeRateLimitError(Exception):
+    """The error of a request rejected with HTTP 429."""
+
+    http_status = 429
+
+
+class FakeChatCompletion:
+    """A chat completion endpoint with a quota, rejecting requests beyond it with 429s.
+
+    At most max_concurrency requests are served at once and at most
+    requests_per_second are accepted, each taking latency seconds. Use it as the
+    client of a ChatOpenAI.
+    """
+
+    def __init__(self, max_concurrency=4, requests_per_second=50, latency=0.05):
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.accepted = deque()
+        self.num_requests = 0
+        self.num_rejected = 0
+
+    def create(self, messages, **kwargs):
+        with self.lock:
+            self.num_requests += 1
+            now = time.monotonic()
+            while self.accepted and self.accepted[0] < now - 1:
+                self.accepted.popleft()
+            if (
+                self.in_flight >= self.max_concurrency
+                or len(self.accepted) >= self.requests_per_second
+            ):
+                self.num_rejected += 1
+                raise FakeRateLimitError("Rate limit reached")
+            self.in_flight += 1
+            self.accepted.append(now)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        prompt = "\n".join(message["content"] for message in messages)
+        completion = fake_text(prompt, 20)
+        return {
+            "choices": [
+                {
+                    "message": {"role": "assistant", "content": completion},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": len(prompt.split()),
+                "completion_tokens": 20,
+                "total_tokens": len(prompt.split()) + 20,
+            },
+        }
@@ -1,40 +1,68 @@
 import argparse
 from dataclasses import asdict
+from functools import partial
 import json
 import os
 import streamlit as st
 
 from data_driven_characters.character import get_character_definition
-from data_driven_characters.corpus import (
-    get_corpus_summaries,
-    load_docs,
-)
+from data_driven_characters.chunking import get_tokenized_corpus
+from data_driven_characters.constants import EMBEDDING_CACHE_PATH, OUTPUT_ROOT
+from data_driven_characters.corpus import get_corpus_summaries, iter_docs
 
 from data_driven_characters.chatbots import (
     SummaryChatBot,
     RetrievalChatBot,
     SummaryRetrievalChatBot,
 )
-from data_driven_characters.interfaces import CommandLine, Streamlit
+from data_driven_characters.clients import get_embeddings
+from data_driven_characters.embeddings import EMBEDDING_BACKENDS
+from data_driven_characters.hierarchy import get_hierarchical_vectorstore
+from data_driven_characters.index import INDEX_TYPES, load_corpus_vectorstore
+from data_driven_characters.interfaces import CommandLine, Server, Streamlit
+from data_driven_characters.memory import TurnWriter
+from data_driven_characters.tracing import create_exporters, set_exporters
 
-OUTPUT_ROOT = "output"
 
+def create_chatbot_factory(
+    corpus,
+    character_name,
+    chatbot_type,
+    retrieval_docs,
+    summary_type,
+    max_history_tokens=None,
+    max_context_tokens=None,
+    mmr_lambda=None,
+    index_type="flat",
+    embedding_backend="openai",
+    max_prompt_tokens=None,
+):
+    """Prepare everything a chatbot needs and return a function that creates one.
 
-def create_chatbot(corpus, character_name, chatbot_type, retrieval_docs, summary_type):
+    The character definition and retrieval documents are shared by every
+    chatbot the factory creates, while each chatbot has its own memory.
+    """
     # logging
     corpus_name = os.path.splitext(os.path.basename(corpus))[0]
     output_dir = f"{OUTPUT_ROOT}/{corpus_name}/summarytype_{summary_type}"
     os.makedirs(output_dir, exist_ok=True)
     summaries_dir = f"{output_dir}/summaries"
+    index_dir = f"{output_dir}/indexes"
     character_definitions_dir = f"{output_dir}/character_definitions"
     os.makedirs(character_definitions_dir, exist_ok=True)
 
-    # load docs
-    docs = load_docs(corpus_path=corpus, chunk_size=2048, chunk_overlap=64)
-
-    # generate summaries
+    # generate summaries, streaming the chunks of the corpus unless the raw
+    # chunks are indexed too, in which case the corpus is tokenized once for
+    # every chunk size
+    if retrieval_docs in ("raw", "hierarchical"):
+        tokenized_corpus = get_tokenized_corpus(corpus)
+        summary_docs = tokenized_corpus.docs(chunk_size=2048, chunk_overlap=64)
+    else:
+        summary_docs = iter_docs(corpus, chunk_size=2048, chunk_overlap=64)
     corpus_summaries = get_corpus_summaries(
-        docs=docs, summary_type=summary_type, cache_dir=summaries_dir
+        docs=summary_docs,
+        summary_type=summary_type,
+        cache_dir=summaries_dir,
     )
 
     # get character definition
@@ -46,32 +74,101 @@ def create_chatbot(corpus, character_name, chatbot_type, retrieval_docs, summary
     print(json.dumps(asdict(character_definition), indent=4))
 
     # construct retrieval documents
-    if retrieval_docs == "raw":
-        documents = [
-            doc.page_content
-            for doc in load_docs(corpus_path=corpus, chunk_size=256, chunk_overlap=16)
-        ]
+    if retrieval_docs in ("raw", "hierarchical"):
+        chunk_docs = tokenized_corpus.docs(chunk_size=256, chunk_overlap=16)
+        documents = [doc.page_content for doc in chunk_docs]
     elif retrieval_docs == "summarized":
         documents = corpus_summaries
     else:
         raise ValueError(f"Unknown retrieval docs type: {retrieval_docs}")
 
+    # load the retrieval index once for every chatbot
+    if "retrieval" in chatbot_type:
+        # remote query embeddings are also cached on disk across restarts
+        embeddings = get_embeddings(
+            embedding_backend,
+            cache_path=None if embedding_backend == "hashing" else EMBEDDING_CACHE_PATH,
+        )
+        turn_writer = TurnWriter(embeddings)
+        if retrieval_docs == "hierarchical":
+            # search the summaries, then the raw chunks of the best summarized chunks
+            corpus_vectorstore = get_hierarchical_vectorstore(
+                corpus_summaries,
+                summary_docs,
+                chunk_docs,
+                embeddings,
+                index_dir,
+                index_type=index_type,
+            )
+        else:
+            corpus_vectorstore = load_corpus_vectorstore(
+                documents, embeddings, index_dir, index_type
+            )
+
     # initialize chatbot
     if chatbot_type == "summary":
-        chatbot = SummaryChatBot(character_definition=character_definition)
+        return partial(
+            SummaryChatBot,
+            character_definition=character_definition,
+            max_history_tokens=max_history_tokens,
+            max_prompt_tokens=max_prompt_tokens,
+        )
     elif chatbot_type == "retrieval":
-        chatbot = RetrievalChatBot(
+        return partial(
+            RetrievalChatBot,
             character_definition=character_definition,
             documents=documents,
+            corpus_vectorstore=corpus_vectorstore,
+            max_history_tokens=max_history_tokens,
+            max_context_tokens=max_context_tokens,
+            mmr_lambda=mmr_lambda,
+            embeddings=embeddings,
+            turn_writer=turn_writer,
+            max_prompt_tokens=max_prompt_tokens,
         )
     elif chatbot_type == "summary_retrieval":
-        chatbot = SummaryRetrievalChatBot(
+        return partial(
+            SummaryRetrievalChatBot,
             character_definition=character_definition,
             documents=documents,
+            corpus_vectorstore=corpus_vectorstore,
+            max_history_tokens=max_history_tokens,
+            max_context_tokens=max_context_tokens,
+            mmr_lambda=mmr_lambda,
+            embeddings=embeddings,
+            turn_writer=turn_writer,
+            max_prompt_tokens=max_prompt_tokens,
         )
     else:
         raise ValueError(f"Unknown chatbot type: {chatbot_type}")
-    return chatbot
+
+
+def create_chatbot(
+    corpus,
+    character_name,
+    chatbot_type,
+    retrieval_docs,
+    summary_type,
+    max_history_tokens=None,
+    max_context_tokens=None,
+    mmr_lambda=None,
+    index_type="flat",
+    embedding_backend="openai",
+    max_prompt_tokens=None,
+):
+    return create_chatbot_factory(
+        corpus,
+        character_name,
+        chatbot_type,
+        retrieval_docs,
+        summary_type,
+        max_history_tokens,
+        max_context_tokens,
+        mmr_lambda,
+        index_type,
+        embedding_backend,
+        max_prompt_tokens,
+    )()
 
 
 def main():
@@ -96,12 +193,62 @@ def main():
         "--retrieval_docs",
         type=str,
         default="summarized",
-        choices=["raw", "summarized"],
+        choices=["raw", "summarized", "hierarchical"],
     )
     parser.add_argument(
-        "--interface", type=str, default="cli", choices=["cli", "streamlit"]
+        "--interface", type=str, default="cli", choices=["cli", "streamlit", "server"]
     )
+    parser.add_argument(
+        "--max_history_tokens",
+        type=int,
+        default=None,
+        help="token budget of the conversation history (unbounded by default)",
+    )
+    parser.add_argument(
+        "--max_prompt_tokens",
+        type=int,
+        default=None,
+        help="token budget of the whole prompt, including the history and context",
+    )
+    parser.add_argument(
+        "--max_context_tokens",
+        type=int,
+        default=None,
+        help="token budget of the retrieved context (top-k snippets by default)",
+    )
+    parser.add_argument(
+        "--mmr_lambda",
+        type=float,
+        default=None,
+        help="relevance/diversity trade-off for dropping near-duplicate snippets",
+    )
+    parser.add_argument(
+        "--index_type",
+        type=str,
+        default="flat",
+        choices=INDEX_TYPES,
+        help="exact (flat) or approximate nearest neighbor index of the corpus",
+    )
+    parser.add_argument(
+        "--embeddings",
+        type=str,
+        default="openai",
+        choices=EMBEDDING_BACKENDS,
+        help="embedding model of the retrieval indexes ('hashing' works offline)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="file to append JSON lines of stage traces to ('-' for stdout)",
+    )
+    parser.add_argument(
+        "--otel", action="store_true", help="export stage traces to OpenTelemetry"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
     args = parser.parse_args()
+    set_exporters(create_exporters(args.trace, args.otel))
 
     if args.interface == "cli":
         chatbot = create_chatbot(
@@ -110,16 +257,32 @@ def main():
             args.chatbot_type,
             args.retrieval_docs,
             args.summary_type,
+            args.max_history_tokens,
+            args.max_context_tokens,
+            args.mmr_lambda,
+            args.index_type,
+            args.embeddings,
+            args.max_prompt_tokens,
         )
         app = CommandLine(chatbot=chatbot)
     elif args.interface == "streamlit":
-        chatbot = st.cache_resource(create_chatbot)(
+        # share the character across sessions, but give each session its own memory
+        create_chatbot_for_session = st.cache_resource(create_chatbot_factory)(
             args.corpus,
             args.character_name,
             args.chatbot_type,
             args.retrieval_docs,
             args.summary_type,
+            args.max_history_tokens,
+            args.max_context_tokens,
+            args.mmr_lambda,
+            args.index_type,
+            args.embeddings,
+            args.max_prompt_tokens,
         )
+        if "chatbot" not in st.session_state:
+            st.session_state["chatbot"] = create_chatbot_for_session()
+        chatbot = st.session_state["chatbot"]
         st.title("Data Driven Characters")
         st.write("Create your own character chatbots, grounded in existing corpora.")
         st.divider()
@@ -127,6 +290,23 @@ def main():
         if "retrieval" in args.chatbot_type:
             st.markdown(f"**retrieving from**: *{args.retrieval_docs} corpus*")
         app = Streamlit(chatbot=chatbot)
+    elif args.interface == "server":
+        create_chatbot_for_session = create_chatbot_factory(
+            args.corpus,
+            args.character_name,
+            args.chatbot_type,
+            args.retrieval_docs,
+            args.summary_type,
+            args.max_history_tokens,
+            args.max_context_tokens,
+            args.mmr_lambda,
+            args.index_type,
+            args.embeddings,
+            args.max_prompt_tokens,
+        )
+        app = Server(
+            create_chatbot=create_chatbot_for_session, host=args.host, port=args.port
+        )
     else:
         raise ValueError(f"Unknown interface: {args.interface}")
     app.run()
@@ -0,0 +1,216 @@
+"""Generate the definitions of several characters of a corpus concurrently.
+
+Example:
+    python -m data_driven_characters.batch --corpus data/top_gun_maverick.txt --num_characters 3
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+import json
+import os
+
+from data_driven_characters import tracing
+from data_driven_characters.character import get_character_definition
+from data_driven_characters.clients import set_rate_limits
+from data_driven_characters.constants import OUTPUT_ROOT, VERBOSE
+from data_driven_characters.corpus import (
+    get_characters,
+    get_corpus_summaries,
+    iter_docs,
+)
+from data_driven_characters.rate_limit import RateLimiter, set_rate_limiter
+
+CHARACTER_MAX_WORKERS = 8
+
+
+def generate_character_definitions(
+    names,
+    corpus_summaries,
+    cache_dir,
+    max_workers=CHARACTER_MAX_WORKERS,
+    force_refresh=False,
+):
+    """Get the definitions of several characters, generating them concurrently.
+
+    Each definition is written to cache_dir as soon as it is complete, so an
+    interrupted run only regenerates the missing characters.
+    """
+    definitions = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                get_character_definition,
+                name=name,
+                corpus_summaries=corpus_summaries,
+                cache_dir=cache_dir,
+                force_refresh=force_refresh,
+            ): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            definitions[futures[future]] = future.result()
+            if VERBOSE:
+                print(f"Generated the definition of {futures[future]}.")
+    return [definitions[name] for name in names]
+
+
+def get_output_dir(corpus_path, summary_type):
+    """Get the directory where the outputs of a corpus are cached."""
+    corpus_name = os.path.splitext(os.path.basename(corpus_path))[0]
+    return f"{OUTPUT_ROOT}/{corpus_name}/summarytype_{summary_type}"
+
+
+def run_stage(name, fn, describe):
+    """Run a stage of the pipeline. describe(result) summarizes it for reports."""
+    with tracing.stage(name):
+        return fn()
+
+
+def run_pipeline(
+    corpus_path,
+    summary_type="map_reduce",
+    num_characters=3,
+    characters=None,
+    chunk_size=2048,
+    max_workers=CHARACTER_MAX_WORKERS,
+    force_refresh=False,
+    stage=run_stage,
+):
+    """Run summarize -> extract characters -> define characters on a corpus.
+
+    characters are extracted from the corpus unless they are given. Each
+    stage is run by stage(name, fn, describe), and force_refresh regenerates
+    the cached outputs of every stage. Returns the characters and their
+    definitions.
+    """
+    output_dir = get_output_dir(corpus_path, summary_type)
+    character_definitions_dir = f"{output_dir}/character_definitions"
+    os.makedirs(character_definitions_dir, exist_ok=True)
+
+    # the chunks are streamed into summarization, so the corpus is never
+    # held in memory
+    corpus_summaries = stage(
+        "summarize",
+        lambda: get_corpus_summaries(
+            docs=iter_docs(corpus_path, chunk_size=chunk_size, chunk_overlap=64),
+            summary_type=summary_type,
+            cache_dir=f"{output_dir}/summaries",
+            force_refresh=force_refresh,
+        ),
+        lambda summaries: dict(num_summaries=len(summaries)),
+    )
+    if characters is None:
+        characters = stage(
+            "extract_characters",
+            lambda: get_characters(
+                corpus_summaries=corpus_summaries,
+                num_characters=num_characters,
+                cache_dir=output_dir,
+                force_refresh=force_refresh,
+            ),
+            lambda characters: dict(characters=characters),
+        )
+    character_definitions = stage(
+        "define_characters",
+        lambda: generate_character_definitions(
+            names=characters,
+            corpus_summaries=corpus_summaries,
+            cache_dir=character_definitions_dir,
+            max_workers=max_workers,
+            force_refresh=force_refresh,
+        ),
+        lambda definitions: dict(num_definitions=len(definitions)),
+    )
+    return characters, character_definitions
+
+
+def add_pipeline_arguments(parser):
+    """Add the arguments of the pipeline shared by the batch commands."""
+    parser.add_argument("--num_characters", type=int, default=3)
+    parser.add_argument(
+        "--summary_type",
+        type=str,
+        default="map_reduce",
+        choices=["map_reduce", "refine"],
+    )
+    parser.add_argument("--chunk_size", type=int, default=2048)
+    parser.add_argument(
+        "--max_character_workers",
+        type=int,
+        default=CHARACTER_MAX_WORKERS,
+        help="characters at once",
+    )
+    parser.add_argument(
+        "--max_concurrent_requests",
+        type=int,
+        default=8,
+        help="global limit of concurrent LLM requests",
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=None,
+        help="quota of each model",
+    )
+    parser.add_argument(
+        "--tokens_per_minute",
+        type=int,
+        default=None,
+        help="quota of each model, prompts and completions",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="file to append JSON lines of stage traces to ('-' for stdout)",
+    )
+    parser.add_argument(
+        "--otel", action="store_true", help="export stage traces to OpenTelemetry"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate cached summaries and characters",
+    )
+
+
+def setup_pipeline(args, exporters=()):
+    """Install the rate limiters and trace exporters selected by the arguments."""
+    set_rate_limiter(RateLimiter(max_concurrency=args.max_concurrent_requests))
+    # quotas are enforced per model, where the actual usage and the rate limit
+    # errors of each request are known
+    set_rate_limits(args.requests_per_minute, args.tokens_per_minute)
+    tracing.set_exporters(
+        tracing.create_exporters(args.trace, args.otel) + list(exporters)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", type=str, required=True)
+    parser.add_argument(
+        "--characters",
+        type=str,
+        nargs="*",
+        default=None,
+        help="names of the characters (extracted from the corpus by default)",
+    )
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    setup_pipeline(args)
+
+    _, character_definitions = run_pipeline(
+        args.corpus,
+        summary_type=args.summary_type,
+        num_characters=args.num_characters,
+        characters=args.characters or None,
+        chunk_size=args.chunk_size,
+        max_workers=args.max_character_workers,
+        force_refresh=args.force,
+    )
+    for character_definition in character_definitions:
+        print(json.dumps(asdict(character_definition), indent=4))
+
+
+if __name__ == "__main__":
+    main()
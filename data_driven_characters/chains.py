@@ -1,8 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import re
+
 from pydantic import root_validator
-from typing import Tuple, List, Dict
+from typing import Any, Tuple, List, Dict, Optional
 
 from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
 from langchain.base_language import BaseLanguageModel
 from langchain.chains.base import Chain
 from langchain.prompts.chat import (
@@ -11,6 +13,12 @@ from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
 )
 
+from data_driven_characters.clients import get_llm
+from data_driven_characters.constants import VERBOSE
+from data_driven_characters.llm_cache import cached_run
+from data_driven_characters.tracing import current_span, in_current_trace, traced
+from data_driven_characters.utils import truncate_words
+
 
 def define_description_chain():
     """Define the chain for generating character descriptions."""
@@ -37,13 +45,22 @@ Your description should exaggerate the style, mannerisms, and personality of you
     description_prompt = ChatPromptTemplate.from_messages(
         [system_message, human_message]
     )
-    GPT4 = ChatOpenAI(model_name="gpt-4")
-    description_chain = LLMChain(llm=GPT4, prompt=description_prompt, verbose=True)
+    GPT4 = get_llm("gpt-4")
+    description_chain = LLMChain(llm=GPT4, prompt=description_prompt, verbose=VERBOSE)
     return description_chain
 
 
 class FitCharLimit(Chain):
-    """Fit the character limit to the length of the description."""
+    """Fit the character limit to the length of the description.
+
+    Each round revises the best candidate so far into num_candidates new
+    candidates in parallel and keeps the one closest to character_range. A
+    candidate that is at most trim_margin too long is trimmed sentence by
+    sentence instead of revised again. After max_attempts rounds, the best
+    candidate is trimmed, or cut at a word boundary if it is still too long,
+    since the upper limit is a hard one. The number of LLM calls is recorded
+    on the description_fitting span.
+    """
 
     chain: Chain
     character_range: Tuple[int, int]
@@ -60,8 +77,11 @@ Your previous revision was the following:
 Your revision contains {num_char} characters.
 Re-write the passage to contain {char_limit} characters while preserving the style and content of the original passage.
 Cut the least salient points if necessary.
-Your revision should be in {perspective}.
+Your revision should be in the same point of view as the original passage.
 """
+    max_attempts: int = 5
+    num_candidates: int = 1
+    trim_margin: float = 0.2
     verbose: bool = False
 
     @root_validator(pre=True)
@@ -84,54 +104,79 @@ Your revision should be in {perspective}.
     def output_keys(self) -> List[str]:
         return ["output"]
 
-    def _call(self, inputs: Dict[str, str]) -> Dict[str, str]:
-        output_1 = self.chain_1.run(inputs)
-        output_2 = self.chain_2.run(inputs)
-        return {"concat_output": output_1 + output_2}
-
-    def _call(self, inputs: Dict[str, str]) -> Dict[str, str]:
-        response = self.chain.run(**inputs)
+    def distance(self, text: str) -> int:
+        """Number of characters by which text misses character_range."""
+        lower, upper = self.character_range
+        return max(lower - len(text), len(text) - upper, 0)
+
+    def trim(self, text: str, margin: Optional[float] = None) -> Optional[str]:
+        """Drop trailing sentences until text fits, or return None if it cannot."""
+        lower, upper = self.character_range
+        if len(text) <= upper:
+            return None
+        if margin is not None and len(text) - upper > margin * upper:
+            return None
+        sentences = re.split(r"(?<=[.!?])\s+", text.strip())
+        while len(sentences) > 1 and len(" ".join(sentences)) > upper:
+            sentences.pop()
+        trimmed = " ".join(sentences)
+        return trimmed if lower <= len(trimmed) <= upper else None
+
+    @traced("description_fitting")
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        current_span().set(char_limit=self.character_range[1])
+        response = cached_run(self.chain, **inputs)
+        num_attempts = 1
         if self.verbose:
             print(response)
             print(f"Initial response: {len(response)} characters.")
 
-        perspective = LLMChain(
+        revision_chain = LLMChain(
             llm=self.llm,
-            prompt=PromptTemplate.from_template(
-                """
-What point of view is the following passage?
----
-{passage}
----
-Choose one of:
-- first person
-- second person
-- third person
-"""
-            ),
-        ).run(passage=response)
-
-        original_response = response
-        i = 0
-        while (
-            len(response) < self.character_range[0]
-            or len(response) > self.character_range[1]
-        ):
-            response = LLMChain(
-                llm=self.llm,
-                prompt=PromptTemplate.from_template(self.revision_prompt_template),
-                verbose=self.verbose,
-            ).run(
-                passage=original_response,
-                revision=response,
-                num_char=len(response),
-                char_limit=self.character_range[0],
-                perspective=perspective,
-            )
-
-            i += 1
+            prompt=PromptTemplate.from_template(self.revision_prompt_template),
+            verbose=self.verbose,
+        )
+        target = sum(self.character_range) // 2
+        best = response
+        for i in range(self.max_attempts):
+            if self.distance(best) == 0:
+                break
+            trimmed = self.trim(best, margin=self.trim_margin)
+            if trimmed is not None:
+                best = trimmed
+                break
+
+            def revise(j):
+                # salted with the attempt so that a cached run replays the same path
+                return cached_run(
+                    revision_chain,
+                    salt=f"{i}-{j}",
+                    passage=response,
+                    revision=best,
+                    num_char=len(best),
+                    char_limit=target,
+                )
+
+            with ThreadPoolExecutor(max_workers=self.num_candidates) as executor:
+                candidates = list(
+                    executor.map(in_current_trace(revise), range(self.num_candidates))
+                )
+            num_attempts += len(candidates)
+            best = min([best] + candidates, key=self.distance)
             if self.verbose:
-                print(response)
-                print(f"Retry {i}: {len(response)} characters.")
-
-        return {"output": response}
+                print(best)
+                print(f"Retry {i + 1}: {len(best)} characters.")
+
+        if self.distance(best) > 0:
+            best = self.trim(best) or best
+        truncated = len(best) > self.character_range[1]
+        if truncated:
+            best = truncate_words(best, self.character_range[1])
+        current_span().set(
+            num_attempts=num_attempts, num_characters=len(best), truncated=truncated
+        )
+        if self.verbose:
+            print(f"Final response: {len(best)} characters, {num_attempts} attempts.")
+            if truncated:
+                print("Truncated to fit the character limit.")
+        return {"output": best}
@@ -1,16 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
 import json
 import os
 
-from langchain.chat_models import ChatOpenAI
 from langchain import PromptTemplate, LLMChain
 
 from data_driven_characters.chains import FitCharLimit, define_description_chain
 
+from data_driven_characters.clients import get_llm
 from data_driven_characters.constants import VERBOSE
+from data_driven_characters.llm_cache import cached_run
+from data_driven_characters.tracing import current_span, in_current_trace, traced
 from data_driven_characters.utils import (
     order_of_magnitude,
     apply_file_naming_convention,
+    write_atomic,
 )
 
 
@@ -27,7 +31,7 @@ def generate_character_ai_description(name, corpus_summaries, char_limit):
     lower_limit = char_limit - 10 ** (order_of_magnitude(char_limit))
 
     description_chain = define_description_chain()
-    GPT4 = ChatOpenAI(model_name="gpt-4")
+    GPT4 = get_llm("gpt-4")
     char_limit_chain = FitCharLimit(
         chain=description_chain,
         character_range=(lower_limit, char_limit),
@@ -59,10 +63,9 @@ Long description:
 Generate a greeting that {name} would say to someone they just met, without quotations.
 This greeting should reflect their personality.
 """
-    GPT3 = ChatOpenAI(model_name="gpt-3.5-turbo")
-    greeting = LLMChain(
-        llm=GPT3, prompt=PromptTemplate.from_template(greeting_template)
-    ).run(
+    GPT3 = get_llm("gpt-3.5-turbo")
+    greeting = cached_run(
+        LLMChain(llm=GPT3, prompt=PromptTemplate.from_template(greeting_template)),
         name=name,
         short_description=short_description,
         long_description=long_description,
@@ -72,14 +75,20 @@ This greeting should reflect their personality.
     return greeting
 
 
+@traced("character_definition")
 def generate_character_definition(name, corpus_summaries):
     """Generate a Character.ai definition."""
-    short_description = generate_character_ai_description(
-        name=name, corpus_summaries=corpus_summaries, char_limit=50
-    )
-    long_description = generate_character_ai_description(
-        name=name, corpus_summaries=corpus_summaries, char_limit=500
-    )
+    current_span().set(character=name)
+    # the descriptions are independent, so generate them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        short_description, long_description = executor.map(
+            in_current_trace(
+                lambda char_limit: generate_character_ai_description(
+                    name=name, corpus_summaries=corpus_summaries, char_limit=char_limit
+                )
+            ),
+            [50, 500],
+        )
     greeting = generate_greeting(name, short_description, long_description)
 
     # populate the dataclass
@@ -98,8 +107,7 @@ def get_character_definition(name, corpus_summaries, cache_dir, force_refresh=Fa
 
     if not os.path.exists(cache_path) or force_refresh:
         character_definition = generate_character_definition(name, corpus_summaries)
-        with open(cache_path, "w") as f:
-            json.dump(asdict(character_definition), f)
+        write_atomic(cache_path, json.dumps(asdict(character_definition)))
     else:
         with open(cache_path, "r") as f:
             character_definition = Character(**json.load(f))
@@ -0,0 +1,105 @@
+from functools import lru_cache
+
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain.schema import AIMessage, SystemMessage
+
+from data_driven_characters.tracing import stage
+from data_driven_characters.utils import count_tokens, estimate_tokens
+
+CHAT_TOKENS_PER_MESSAGE = 4  # the role and delimiters of a chat message
+
+
+class TracedChatPromptTemplate(ChatPromptTemplate):
+    """ChatPromptTemplate that records every render as a prompt_render stage."""
+
+    def format_prompt(self, **kwargs):
+        with stage("prompt_render") as span:
+            prompt = super().format_prompt(**kwargs)
+            span.set(
+                tokens=sum(
+                    estimate_tokens(message.content) for message in prompt.messages
+                )
+            )
+        return prompt
+
+
+def escape_braces(text):
+    """Escape text so that it is rendered literally by a format-string template."""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@lru_cache(maxsize=128)
+def _get_character_prompt(
+    name, long_description, greeting, context_key, chat_history_key, input_key
+):
+    persona = f"Your name is {name}.\n"
+    if long_description is not None:
+        persona += f"""Here is how you describe yourself:
+---
+{long_description}
+---
+"""
+    persona += f"""
+You will have a conversation with a Human, and you will engage in a dialogue with them.
+You will exaggerate your personality, interests, desires, emotions, and other traits.
+You will stay in character as {name} throughout the conversation, even if the Human asks you questions that you don't know the answer to.
+You will not break character as {name}."""
+
+    # the history only grows between turns, so it goes before the retrieved
+    # context, which changes on every turn
+    name = escape_braces(name)
+    history = f"""Current conversation:
+---
+{{{chat_history_key}}}"""
+    suffix = "---\n"
+    if context_key is not None:
+        suffix += f"""You are {name} in the following story snippets, which describe events in your life.
+---
+{{{context_key}}}
+---
+"""
+    suffix += f"""
+Human: {{{input_key}}}
+{name}:"""
+    return TracedChatPromptTemplate.from_messages(
+        [
+            SystemMessage(content=persona),
+            AIMessage(content=greeting),
+            HumanMessagePromptTemplate.from_template(history),
+            HumanMessagePromptTemplate.from_template(suffix),
+        ]
+    )
+
+
+def get_character_prompt(
+    character_definition,
+    include_description=True,
+    context_key=None,
+    chat_history_key="chat_history",
+    input_key="input",
+):
+    """Get the chat prompt of a character, compiled once and shared by its chatbots.
+
+    The persona, description and greeting are pre-rendered into a static prefix
+    of messages, which is identical on every turn so that it can be reused by
+    provider-side prompt caching. The history and then the retrieved context
+    and input are rendered per turn.
+    """
+    return _get_character_prompt(
+        character_definition.name,
+        character_definition.long_description if include_description else None,
+        character_definition.greeting,
+        context_key,
+        chat_history_key,
+        input_key,
+    )
+
+
+def count_prompt_tokens(prompt, **inputs):
+    """Count the tokens of a chat prompt, with the inputs that are not given empty."""
+    values = dict.fromkeys(prompt.input_variables, "")
+    values.update(inputs)
+    return sum(
+        count_tokens(message.content) + CHAT_TOKENS_PER_MESSAGE
+        for message in prompt.format_messages(**values)
+    )
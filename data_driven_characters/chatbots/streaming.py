@@ -0,0 +1,67 @@
+import asyncio
+from queue import Queue
+from threading import Thread
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from data_driven_characters.tracing import in_current_trace, stage
+
+_DONE = object()
+
+
+class QueueCallbackHandler(BaseCallbackHandler):
+    """Put each new LLM token on a queue."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.queue.put(token)
+
+
+def stream_chain(chain, **inputs):
+    """Run a chain in a background thread, yielding LLM tokens as they arrive.
+
+    The chain runs to completion as usual, so its memory is saved once the
+    stream ends. It is traced as a chat_turn stage. If the LLM does not
+    stream, e.g. a cached response, its whole response is yielded at the end.
+    """
+    queue = Queue()
+    results = []
+    errors = []
+
+    def run():
+        try:
+            with stage("chat_turn"):
+                results.append(
+                    chain.run(callbacks=[QueueCallbackHandler(queue)], **inputs)
+                )
+        except Exception as e:
+            errors.append(e)
+        finally:
+            queue.put(_DONE)
+
+    thread = Thread(target=in_current_trace(run), daemon=True)
+    thread.start()
+    streamed = False
+    while (token := queue.get()) is not _DONE:
+        streamed = True
+        yield token
+    thread.join()
+    if errors:
+        raise errors[0]
+    if not streamed and results[0]:
+        yield results[0]
+
+
+async def arun_chain(chain, **inputs):
+    """Run an LLMChain with memory, such as a ConversationChain, asynchronously.
+
+    LangChain loads and saves memory synchronously even in arun, and the
+    retrieval memory embeds the query and waits for indexed turns, so memory
+    is loaded and saved in a thread to keep the event loop free.
+    """
+    inputs = await asyncio.to_thread(chain.prep_inputs, inputs)
+    outputs = chain.create_outputs(await chain.agenerate([inputs]))[0]
+    await asyncio.to_thread(chain.prep_outputs, inputs, outputs)
+    return outputs[chain.output_key]
@@ -1,46 +1,55 @@
-from langchain.prompts import PromptTemplate
 from langchain.chains import ConversationChain
-from langchain.chat_models import ChatOpenAI
 
-from langchain.memory import ConversationBufferMemory
+from data_driven_characters.chatbots.prompts import (
+    count_prompt_tokens,
+    get_character_prompt,
+)
+from data_driven_characters.chatbots.streaming import arun_chain, stream_chain
+from data_driven_characters.clients import get_llm
+from data_driven_characters.constants import VERBOSE
+from data_driven_characters.memory import create_conversation_memory
+from data_driven_characters.tracing import traced
 
 
 class SummaryChatBot:
-    def __init__(self, character_definition):
+    def __init__(
+        self, character_definition, max_history_tokens=None, max_prompt_tokens=None
+    ):
         self.character_definition = character_definition
+        self.max_history_tokens = max_history_tokens
+        self.max_prompt_tokens = max_prompt_tokens
         self.chain = self.create_chain(character_definition)
 
     def create_chain(self, character_definition):
-        GPT3 = ChatOpenAI(model_name="gpt-3.5-turbo")
-
-        memory = ConversationBufferMemory(memory_key="chat_history", input_key="input")
-        prompt = PromptTemplate.from_template(
-            f"""Your name is {character_definition.name}.
-Here is how you describe yourself:
----
-{character_definition.long_description}
----
-
-You will have a conversation with a Human, and you will engage in a dialogue with them.
-You will exaggerate your personality, interests, desires, emotions, and other traits.
-You will stay in character as {character_definition.name} throughout the conversation, even if the Human asks you questions that you don't know the answer to.
-You will not break character as {character_definition.name}.
-
-Current conversation:
----
-{character_definition.name}: {character_definition.greeting}
-{{chat_history}}
----
-Human: {{input}}
-{character_definition.name}:"""
+        GPT3 = get_llm("gpt-3.5-turbo", streaming=True)
+
+        prompt = get_character_prompt(character_definition)
+        # the rest of the prompt counts against max_prompt_tokens as well
+        prompt_token_overhead = 0
+        if self.max_prompt_tokens is not None:
+            prompt_token_overhead = count_prompt_tokens(prompt)
+        memory = create_conversation_memory(
+            memory_key="chat_history",
+            input_key="input",
+            max_token_limit=self.max_history_tokens,
+            max_prompt_tokens=self.max_prompt_tokens,
+            prompt_token_overhead=prompt_token_overhead,
         )
         chatbot = ConversationChain(
-            llm=GPT3, verbose=True, memory=memory, prompt=prompt
+            llm=GPT3, verbose=VERBOSE, memory=memory, prompt=prompt
         )
         return chatbot
 
     def greet(self):
         return self.character_definition.greeting
 
+    @traced("chat_turn")
     def step(self, input):
         return self.chain.run(input=input)
+
+    @traced("chat_turn")
+    async def astep(self, input):
+        return await arun_chain(self.chain, input=input)
+
+    def stream_step(self, input):
+        yield from stream_chain(self.chain, input=input)
@@ -1,24 +1,55 @@
-import faiss
-from tqdm import tqdm
-
 from langchain.chains import ConversationChain
-from langchain.chat_models import ChatOpenAI
-from langchain.docstore import InMemoryDocstore
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.memory import (
-    ConversationBufferMemory,
-    CombinedMemory,
-)
-from langchain.prompts import PromptTemplate
-from langchain.vectorstores import FAISS
+from langchain.memory import CombinedMemory
 
-from data_driven_characters.memory import ConversationVectorStoreRetrieverMemory
+from data_driven_characters.chatbots.prompts import (
+    count_prompt_tokens,
+    get_character_prompt,
+)
+from data_driven_characters.chatbots.streaming import arun_chain, stream_chain
+from data_driven_characters.clients import get_embeddings, get_llm
+from data_driven_characters.constants import VERBOSE
+from data_driven_characters.index import build_vectorstore, load_corpus_vectorstore
+from data_driven_characters.memory import (
+    ConversationVectorStoreRetrieverMemory,
+    TurnWriter,
+    create_conversation_memory,
+)
+from data_driven_characters.tracing import traced
 
 
 class SummaryRetrievalChatBot:
-    def __init__(self, character_definition, documents):
+    def __init__(
+        self,
+        character_definition,
+        documents,
+        index_dir=None,
+        corpus_vectorstore=None,
+        max_history_tokens=None,
+        max_context_tokens=None,
+        mmr_lambda=None,
+        index_type="flat",
+        embeddings=None,
+        turn_writer=None,
+        max_prompt_tokens=None,
+    ):
         self.character_definition = character_definition
         self.documents = documents
+        self.index_dir = index_dir
+        self.corpus_vectorstore = corpus_vectorstore
+        self.max_history_tokens = max_history_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        if max_context_tokens is None and max_prompt_tokens is not None:
+            # the retrieved context has to fit in the prompt budget as well
+            max_context_tokens = max_prompt_tokens // 4
+        self.max_context_tokens = max_context_tokens
+        self.mmr_lambda = mmr_lambda
+        self.index_type = index_type
+        self.embeddings = get_embeddings() if embeddings is None else embeddings
+        # turns are indexed off the request path, batched across conversations
+        # that share the writer
+        self.turn_writer = (
+            TurnWriter(self.embeddings) if turn_writer is None else turn_writer
+        )
         self.num_context_memories = 12
 
         self.chat_history_key = "chat_history"
@@ -28,61 +59,79 @@ class SummaryRetrievalChatBot:
         self.chain = self.create_chain(character_definition)
 
     def create_chain(self, character_definition):
-        conv_memory = ConversationBufferMemory(
-            memory_key=self.chat_history_key, input_key=self.input_key
+        prompt = get_character_prompt(
+            character_definition,
+            context_key=self.context_key,
+            chat_history_key=self.chat_history_key,
+            input_key=self.input_key,
+        )
+        # the rest of the prompt, including the retrieved context, counts
+        # against max_prompt_tokens as well
+        prompt_token_overhead = 0
+        if self.max_prompt_tokens is not None:
+            prompt_token_overhead = (
+                count_prompt_tokens(prompt) + self.max_context_tokens
+            )
+        conv_memory = create_conversation_memory(
+            memory_key=self.chat_history_key,
+            input_key=self.input_key,
+            max_token_limit=self.max_history_tokens,
+            max_prompt_tokens=self.max_prompt_tokens,
+            prompt_token_overhead=prompt_token_overhead,
         )
 
+        # the documents are embedded once, cached in index_dir and shared
+        # read-only, while the turns of this conversation get their own index
+        embeddings = self.embeddings
+        if self.corpus_vectorstore is None:
+            self.corpus_vectorstore = load_corpus_vectorstore(
+                self.documents, embeddings, self.index_dir, self.index_type
+            )
+        turn_vectorstore = build_vectorstore([], embeddings)
         context_memory = ConversationVectorStoreRetrieverMemory(
-            retriever=FAISS(
-                OpenAIEmbeddings().embed_query,
-                faiss.IndexFlatL2(1536),  # Dimensions of the OpenAIEmbeddings
-                InMemoryDocstore({}),
-                {},
-            ).as_retriever(search_kwargs=dict(k=self.num_context_memories)),
+            retriever=turn_vectorstore.as_retriever(
+                search_kwargs=dict(k=self.num_context_memories)
+            ),
+            corpus_vectorstore=self.corpus_vectorstore,
+            max_context_tokens=self.max_context_tokens,
+            mmr_lambda=self.mmr_lambda,
+            turn_writer=self.turn_writer,
             memory_key=self.context_key,
             output_prefix=character_definition.name,
             blacklist=[self.chat_history_key],
         )
-        # add the documents to the context memory
-        for i, summary in tqdm(enumerate(self.documents)):
-            context_memory.save_context(inputs={}, outputs={f"[{i}]": summary})
+
+        self.context_memory = context_memory
 
         # Combined
         memory = CombinedMemory(memories=[conv_memory, context_memory])
-        prompt = PromptTemplate.from_template(
-            f"""Your name is {character_definition.name}.
-Here is how you describe yourself:
----
-{character_definition.long_description}
----
-
-You will have a conversation with a Human, and you will engage in a dialogue with them.
-You will exaggerate your personality, interests, desires, emotions, and other traits.
-You will stay in character as {character_definition.name} throughout the conversation, even if the Human asks you questions that you don't know the answer to.
-You will not break character as {character_definition.name}.
-
-You are {character_definition.name} in the following story snippets, which describe events in your life.
----
-{{{self.context_key}}}
----
-
-Current conversation:
----
-{character_definition.name}: {character_definition.greeting}
-{{{self.chat_history_key}}}
----
-
-Human: {{{self.input_key}}}
-{character_definition.name}:"""
-        )
-        GPT3 = ChatOpenAI(model_name="gpt-3.5-turbo")
+        GPT3 = get_llm("gpt-3.5-turbo", streaming=True)
         chatbot = ConversationChain(
-            llm=GPT3, verbose=True, memory=memory, prompt=prompt
+            llm=GPT3, verbose=VERBOSE, memory=memory, prompt=prompt
         )
         return chatbot
 
+    def cache_stats(self):
+        """Hit rates of the query embedding and retrieval caches."""
+        stats = {
+            # shared by every conversation over the same corpus
+            "corpus_results": self.context_memory.corpus_results_stats.as_dict(),
+            "turn_results": self.context_memory.turn_results_stats.as_dict(),
+        }
+        if hasattr(self.embeddings, "stats"):
+            stats["query_embeddings"] = self.embeddings.stats.as_dict()
+        return stats
+
     def greet(self):
         return self.character_definition.greeting
 
+    @traced("chat_turn")
     def step(self, input):
         return self.chain.run(input=input)
+
+    @traced("chat_turn")
+    async def astep(self, input):
+        return await arun_chain(self.chain, input=input)
+
+    def stream_step(self, input):
+        yield from stream_chain(self.chain, input=input)
@@ -0,0 +1,237 @@
+import codecs
+from functools import lru_cache
+import os
+
+import numpy as np
+
+from langchain.schema import Document
+
+from data_driven_characters.tracing import stage
+from data_driven_characters.utils import TOKEN_ENCODING, get_encoder
+
+SEPARATORS = ["\n\n", "\n", " "]
+CORPUS_BLOCK_SIZE = 1 << 20
+
+
+def tokenize(text, encoding_name=TOKEN_ENCODING):
+    """Get the character offset of every token of a text."""
+    encoder = get_encoder(encoding_name)
+    tokens = encoder.encode(text, disallowed_special=())
+    _, offsets = encoder.decode_with_offsets(tokens)
+    return offsets
+
+
+class TokenizedCorpus:
+    """A corpus that is tokenized once and can then be chunked at any size.
+
+    Only the text and the character offset of every token are kept, as an int32
+    array, so any chunk_size/chunk_overlap layout is cut from the offsets
+    without encoding the text again. Like RecursiveCharacterTextSplitter,
+    chunk ends prefer paragraph, then line, then word boundaries.
+    """
+
+    def __init__(self, text, encoding_name=TOKEN_ENCODING, offsets=None):
+        self.text = text
+        if offsets is None:
+            with stage("tokenization", characters=len(text)) as span:
+                offsets = tokenize(text, encoding_name)
+                span.set(tokens=len(offsets))
+            # offsets[i] is where token i starts and offsets[-1] is the end of the text
+            offsets = offsets + [len(text)]
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+
+    @classmethod
+    def from_file(cls, corpus_path, encoding_name=TOKEN_ENCODING):
+        # decoded like iter_docs, keeping \r\n, so the offsets match the bytes
+        with open(corpus_path, encoding="utf-8", newline="") as f:
+            return cls(f.read(), encoding_name)
+
+    @property
+    def num_tokens(self):
+        return len(self.offsets) - 1
+
+    def _token_at(self, position):
+        """Index of the first token that starts at or after a character position."""
+        return int(np.searchsorted(self.offsets, position, side="left"))
+
+    def _snap_end(self, start, end):
+        """Move a chunk end back to the last separator in the second half of the chunk."""
+        low = self.offsets[start + (end - start) // 2]
+        high = self.offsets[end]
+        for separator in SEPARATORS:
+            position = self.text.rfind(separator, low, high)
+            if position != -1:
+                snapped = self._token_at(position)
+                if start < snapped <= end:
+                    return snapped
+        return end
+
+    def _snap_start(self, start, end):
+        """Move a chunk start forward to the first separator before end."""
+        low = self.offsets[start]
+        high = self.offsets[end]
+        positions = [self.text.find(separator, low, high) for separator in SEPARATORS]
+        positions = [position for position in positions if position != -1]
+        if positions:
+            snapped = self._token_at(min(positions))
+            if snapped < end:
+                return snapped
+        return start
+
+    def docs(self, chunk_size, chunk_overlap):
+        """Split the corpus into chunks of at most chunk_size tokens."""
+        with stage(
+            "chunking", chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        ) as span:
+            spans, _ = self._split(chunk_size, chunk_overlap)
+            docs = self._documents(spans)
+            span.set(tokens=self.num_tokens, chunks=len(docs))
+        return docs
+
+    def _split(self, chunk_size, chunk_overlap, final=True):
+        """Get the (start, end) tokens of every chunk, and the end of the last one.
+
+        Unless final, the text may continue after the last token, so the
+        chunks that could still reach further are left out and the second
+        return value is the token the next chunk starts at.
+        """
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap should be smaller than chunk_size")
+        spans = []
+        start = 0
+        while start < self.num_tokens:
+            end = start + chunk_size
+            if end < self.num_tokens:
+                end = self._snap_end(start, end)
+            elif final:
+                end = self.num_tokens
+            else:
+                return spans, start
+            spans.append((start, end))
+            if end == self.num_tokens:
+                break
+            start = self._snap_start(max(end - chunk_overlap, start + 1), end)
+        return spans, self.num_tokens
+
+    def _documents(self, spans, start_char=0, start_token=0, start_byte=0):
+        """Create the documents of chunks, with offsets from the given starts."""
+        docs = []
+        position = 0
+        for start, end in spans:
+            # the byte offsets of chunk starts only move forward
+            start_byte += len(self.text[position : self.offsets[start]].encode())
+            position = self.offsets[start]
+            text = self.text[self.offsets[start] : self.offsets[end]]
+            page_content = text.strip()
+            if page_content:
+                docs.append(
+                    Document(
+                        page_content=page_content,
+                        metadata=dict(
+                            start_char=start_char + int(self.offsets[start]),
+                            end_char=start_char + int(self.offsets[end]),
+                            start_token=start_token + start,
+                            end_token=start_token + end,
+                            start_byte=start_byte,
+                            end_byte=start_byte + len(text.encode()),
+                        ),
+                    )
+                )
+        return docs
+
+
+def iter_text_blocks(corpus, block_size=CORPUS_BLOCK_SIZE):
+    """Read and decode a corpus block_size bytes at a time.
+
+    corpus is the path of a UTF-8 text file or a binary file object, such as
+    an upload.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    if isinstance(corpus, (str, os.PathLike)):
+        with open(corpus, "rb") as f:
+            yield from iter_text_blocks(f, block_size)
+        return
+    while block := corpus.read(block_size):
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+
+def find_token_boundary(text):
+    """Find the last position where the text can be cut without changing its tokens.
+
+    No token of the tokenizer spans a non-space followed by a space, so a
+    space after a non-space always starts a new token, and tokenizing both
+    sides of it separately gives the tokens of the whole text. Returns 0 if
+    there is no such position.
+    """
+    position = text.rfind(" ")
+    while position > 0 and text[position - 1].isspace():
+        position = text.rfind(" ", 0, position)
+    return max(position, 0)
+
+
+def iter_docs(
+    corpus,
+    chunk_size,
+    chunk_overlap,
+    block_size=CORPUS_BLOCK_SIZE,
+    encoding_name=TOKEN_ENCODING,
+):
+    """Lazily load a corpus and split it into chunks of at most chunk_size tokens.
+
+    The corpus, a path or a binary file object, is read and tokenized
+    block_size bytes at a time, and only the text from the start of the next
+    chunk on is kept, so memory does not grow with the size of the corpus.
+    Blocks are cut where they do not change the tokens, so the chunks are the
+    same as those of TokenizedCorpus.docs, offsets included.
+    """
+    text = ""  # the tokenized text from the start of the next chunk
+    offsets = np.zeros(1, dtype=np.int32)
+    untokenized = ""
+    start_char = start_token = start_byte = 0
+    blocks = iter_text_blocks(corpus, block_size)
+    final = False
+    while not final:
+        block = next(blocks, None)
+        final = block is None
+        untokenized += block or ""
+        cut = len(untokenized) if final else find_token_boundary(untokenized)
+        if cut == 0 and not final:
+            continue
+        with stage("tokenization", characters=cut) as span:
+            new_offsets = tokenize(untokenized[:cut], encoding_name)
+            span.set(tokens=len(new_offsets))
+        new_offsets = np.array(new_offsets + [cut], dtype=np.int32) + len(text)
+        offsets = np.concatenate([offsets[:-1], new_offsets])
+        text += untokenized[:cut]
+        untokenized = untokenized[cut:]
+
+        corpus_window = TokenizedCorpus(text, encoding_name, offsets)
+        with stage(
+            "chunking", chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        ) as span:
+            spans, next_start = corpus_window._split(chunk_size, chunk_overlap, final)
+            docs = corpus_window._documents(spans, start_char, start_token, start_byte)
+            span.set(tokens=next_start, chunks=len(docs))
+        yield from docs
+
+        # drop the text before the next chunk
+        next_char = int(offsets[next_start])
+        start_char += next_char
+        start_token += next_start
+        start_byte += len(text[:next_char].encode())
+        text = text[next_char:]
+        offsets = offsets[next_start:] - next_char
+
+
+@lru_cache(maxsize=8)
+def _load_tokenized_corpus(corpus_path, mtime_ns, size, encoding_name):
+    return TokenizedCorpus.from_file(corpus_path, encoding_name)
+
+
+def get_tokenized_corpus(corpus_path, encoding_name=TOKEN_ENCODING):
+    """Get the tokenized corpus of a file, tokenizing it only once per version."""
+    stat = os.stat(corpus_path)
+    return _load_tokenized_corpus(
+        os.path.abspath(corpus_path), stat.st_mtime_ns, stat.st_size, encoding_name
+    )
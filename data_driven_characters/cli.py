@@ -0,0 +1,176 @@
+"""Run the corpus -> summaries -> characters -> definitions pipeline headlessly.
+
+Every corpus in a directory is processed on a worker pool. Progress is kept in
+a job manifest, so a run that is interrupted or fails picks up where it left
+off, and every stage emits a JSON line to a progress report.
+
+Example:
+    data_driven_characters --corpora data --num_characters 3
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from data_driven_characters import tracing
+from data_driven_characters.batch import (
+    add_pipeline_arguments,
+    get_output_dir,
+    run_pipeline,
+    setup_pipeline,
+)
+from data_driven_characters.clients import get_rate_limit_metrics
+from data_driven_characters.constants import OUTPUT_ROOT
+from data_driven_characters.utils import write_atomic
+
+
+class JobManifest:
+    """The status of every corpus of a batch run, saved after every update."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+        else:
+            self.jobs = {}
+
+    def get(self, corpus):
+        with self.lock:
+            return dict(self.jobs.get(corpus, {}))
+
+    def update(self, corpus, **fields):
+        with self.lock:
+            self.jobs.setdefault(corpus, {}).update(fields, updated=time.time())
+            write_atomic(self.path, json.dumps(self.jobs, indent=4))
+
+
+class ProgressReport:
+    """Write one JSON object per line for every pipeline event."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, corpus, stage, status, **fields):
+        event = dict(time=time.time(), corpus=corpus, stage=stage, status=status)
+        event.update(fields)
+        with self.lock:
+            self.stream.write(json.dumps(event) + "\n")
+            self.stream.flush()
+
+
+def process_corpus(corpus, args, manifest, report):
+    """Run every stage of the pipeline on one corpus."""
+
+    def stage(name, fn, describe):
+        report(corpus, name, "started")
+        manifest.update(corpus, status="running", stage=name)
+        start = time.perf_counter()
+        with tracing.stage(name, corpus=corpus):
+            result = fn()
+        seconds = time.perf_counter() - start
+        report(corpus, name, "done", seconds=seconds, **describe(result))
+        return result
+
+    characters, _ = run_pipeline(
+        corpus,
+        summary_type=args.summary_type,
+        num_characters=args.num_characters,
+        chunk_size=args.chunk_size,
+        max_workers=args.max_character_workers,
+        force_refresh=args.force,
+        stage=stage,
+    )
+    manifest.update(
+        corpus,
+        status="done",
+        stage=None,
+        output_dir=get_output_dir(corpus, args.summary_type),
+        characters=characters,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate character definitions for every corpus in a directory."
+    )
+    parser.add_argument("--corpora", type=str, default="data")
+    parser.add_argument("--pattern", type=str, default="*.txt")
+    parser.add_argument("--max_workers", type=int, default=4, help="corpora at once")
+    add_pipeline_arguments(parser)
+    parser.add_argument(
+        "--manifest", type=str, default=f"{OUTPUT_ROOT}/batch_manifest.json"
+    )
+    parser.add_argument(
+        "--progress",
+        type=str,
+        default=f"{OUTPUT_ROOT}/batch_progress.jsonl",
+        help="file to append JSON lines of progress to ('-' for stdout)",
+    )
+    args = parser.parse_args()
+
+    # the stage totals go in the last progress event
+    stage_totals = tracing.StageTotals()
+    setup_pipeline(args, [stage_totals])
+    os.makedirs(os.path.dirname(args.manifest) or ".", exist_ok=True)
+    manifest = JobManifest(args.manifest)
+    if args.progress == "-":
+        stream = sys.stdout
+    else:
+        os.makedirs(os.path.dirname(args.progress) or ".", exist_ok=True)
+        stream = open(args.progress, "a")
+    report = ProgressReport(stream)
+
+    corpora = sorted(glob.glob(os.path.join(args.corpora, args.pattern)))
+    pending = [
+        corpus
+        for corpus in corpora
+        if args.force or manifest.get(corpus).get("status") != "done"
+    ]
+    for corpus in set(corpora) - set(pending):
+        report(corpus, "all", "skipped")
+
+    num_failed = 0
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {
+            executor.submit(process_corpus, corpus, args, manifest, report): corpus
+            for corpus in pending
+        }
+        for i, future in enumerate(as_completed(futures)):
+            corpus = futures[future]
+            try:
+                future.result()
+                report(corpus, "all", "done", completed=i + 1, total=len(pending))
+            except Exception as e:
+                num_failed += 1
+                manifest.update(corpus, status="failed", error=repr(e))
+                report(
+                    corpus,
+                    "all",
+                    "failed",
+                    error=repr(e),
+                    traceback=traceback.format_exc(),
+                    completed=i + 1,
+                    total=len(pending),
+                )
+    report(
+        None,
+        "all",
+        "finished",
+        rate_limits=get_rate_limit_metrics(),
+        stages=stage_totals.as_dict(),
+    )
+    if stream is not sys.stdout:
+        stream.close()
+    sys.exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
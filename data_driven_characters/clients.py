@@ -0,0 +1,267 @@
+"""Shared LLM and embedding clients.
+
+Every module gets its models from the client registry instead of constructing
+them, so that each model is created once, every request goes through one pooled
+HTTP session with keep-alive, and requests to each model are limited by a rate
+limiter shared across the package.
+
+To run without the OpenAI API, for example in tests, install a registry with
+fake clients or pointed at a local stub server:
+    set_client_registry(ClientRegistry(llm_factory=lambda model_name, **kwargs: FakeLLM()))
+    set_client_registry(ClientRegistry(api_base="http://127.0.0.1:8080/v1"))
+"""
+from contextlib import asynccontextmanager
+import threading
+
+import aiohttp
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+from langchain.chat_models import ChatOpenAI
+
+from data_driven_characters import embeddings as embedding_backends
+from data_driven_characters.rate_limit import RateLimiter, get_rate_limiter
+from data_driven_characters.tracing import tracing_callback_handler
+from data_driven_characters.utils import (
+    acall_with_backoff,
+    call_with_backoff,
+    estimate_tokens,
+)
+
+DEFAULT_CHAT_MODEL = "gpt-3.5-turbo"
+MODEL_MAX_CONCURRENCY = {"gpt-3.5-turbo": 16, "gpt-4": 4}
+DEFAULT_MODEL_MAX_CONCURRENCY = 8
+HTTP_POOL_SIZE = 32
+
+
+class LimitedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose requests wait for its model's rate limiter.
+
+    Each attempt of a request holds a slot until its response is complete,
+    streamed or not, and reserves the tokens of its messages and max_tokens.
+    Requests are retried on rate limit and other transient errors here instead
+    of by the client, so that the limiter sees every 429 and every attempt
+    holds a slot; only rate limit errors cut the concurrency limit. The reserved
+    tokens are then corrected with the reported usage, or with an estimate of
+    the streamed completion.
+    """
+
+    def completion_with_retry(self, **kwargs):
+        # _generate retries, holding a slot for each attempt
+        return self.client.create(**kwargs)
+
+    def _generate(self, messages, *args, **kwargs):
+        limiter = get_model_limiter(self.model_name)
+        prompt_tokens = estimate_prompt_tokens(messages)
+        tokens = prompt_tokens + (self.max_tokens or 0)
+
+        def generate():
+            with limiter.limit(tokens):
+                result = ChatOpenAI._generate(self, messages, *args, **kwargs)
+            limiter.record_tokens(tokens, get_used_tokens(result, prompt_tokens))
+            return result
+
+        return call_with_backoff(generate, max_retries=self.max_retries)
+
+    async def _agenerate(self, messages, *args, **kwargs):
+        limiter = get_model_limiter(self.model_name)
+        prompt_tokens = estimate_prompt_tokens(messages)
+        tokens = prompt_tokens + (self.max_tokens or 0)
+        # the async client retries with the max_retries of the model it is given
+        llm = self.copy(update={"max_retries": 0})
+
+        async def generate():
+            async with limiter.alimit(tokens):
+                result = await ChatOpenAI._agenerate(llm, messages, *args, **kwargs)
+            limiter.record_tokens(tokens, get_used_tokens(result, prompt_tokens))
+            return result
+
+        return await acall_with_backoff(generate, max_retries=self.max_retries)
+
+
+def estimate_prompt_tokens(messages):
+    """Estimate the tokens of chat messages, for rate limiting."""
+    return sum(estimate_tokens(message.content) for message in messages)
+
+
+def get_used_tokens(result, prompt_tokens):
+    """Get the tokens used by a chat request, estimating them for streamed responses."""
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if "total_tokens" in usage:
+        return usage["total_tokens"]
+    return prompt_tokens + sum(
+        estimate_tokens(generation.text) for generation in result.generations
+    )
+
+
+class ClientRegistry:
+    """Create each client once and share it, its HTTP session and its rate limiter.
+
+    llm_factory(model_name, **kwargs) and embeddings_factory(backend, cache_path)
+    replace how clients are created. api_base points the OpenAI clients at
+    another server. model_max_concurrency overrides MODEL_MAX_CONCURRENCY.
+    model_rate_limits maps model names to the requests_per_minute and
+    tokens_per_minute of their quota, if known, and default_rate_limits is the
+    quota of the other models. Whether or not it is known, the concurrency of
+    each model adapts to its rate limit errors.
+    """
+
+    def __init__(
+        self,
+        llm_factory=None,
+        embeddings_factory=None,
+        api_base=None,
+        pool_size=HTTP_POOL_SIZE,
+        model_max_concurrency=None,
+        model_rate_limits=None,
+        default_rate_limits=None,
+    ):
+        self.llm_factory = llm_factory or LimitedChatOpenAI
+        self.embeddings_factory = embeddings_factory or (
+            lambda backend, cache_path: embedding_backends.get_embeddings(
+                backend,
+                cache_path=cache_path,
+                limiter=self.get_model_limiter(
+                    embedding_backends.OPENAI_EMBEDDING_MODEL
+                ),
+            )
+        )
+        self.api_base = api_base
+        self.model_max_concurrency = dict(MODEL_MAX_CONCURRENCY)
+        self.model_max_concurrency.update(model_max_concurrency or {})
+        self.model_rate_limits = model_rate_limits or {}
+        self.default_rate_limits = default_rate_limits or {}
+        self.llms = {}
+        self.embeddings = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+        # one connection pool with keep-alive for every thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def install(self):
+        """Route the requests of the OpenAI clients through this registry."""
+        openai.requestssession = self.session
+        if self.api_base is not None:
+            openai.api_base = self.api_base
+
+    def get_llm(self, model_name=DEFAULT_CHAT_MODEL, **kwargs):
+        key = (model_name, tuple(sorted(kwargs.items())))
+        with self.lock:
+            if key not in self.llms:
+                llm = self.llm_factory(model_name=model_name, **kwargs)
+                llm.callbacks = list(llm.callbacks or []) + [tracing_callback_handler]
+                self.llms[key] = llm
+            return self.llms[key]
+
+    def get_embeddings(self, backend="openai", cache_path=None):
+        key = (backend, cache_path)
+        with self.lock:
+            if key not in self.embeddings:
+                self.embeddings[key] = self.embeddings_factory(backend, cache_path)
+            return self.embeddings[key]
+
+    def get_model_limiter(self, model_name):
+        with self.lock:
+            if model_name not in self.limiters:
+                self.limiters[model_name] = RateLimiter(
+                    max_concurrency=self.model_max_concurrency.get(
+                        model_name, DEFAULT_MODEL_MAX_CONCURRENCY
+                    ),
+                    adaptive=True,
+                    **self.model_rate_limits.get(model_name, self.default_rate_limits),
+                )
+            return self.limiters[model_name]
+
+    def set_rate_limits(
+        self, requests_per_minute=None, tokens_per_minute=None, model_name=None
+    ):
+        """Set the quota of a model, or the default quota if model_name is None."""
+        rate_limits = dict(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        with self.lock:
+            if model_name is None:
+                self.default_rate_limits = rate_limits
+            else:
+                self.model_rate_limits[model_name] = rate_limits
+            # clients keep their limiters, so update them in place
+            for name, limiter in self.limiters.items():
+                limiter.set_quota(
+                    **self.model_rate_limits.get(name, self.default_rate_limits)
+                )
+
+    def rate_limit_metrics(self):
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {
+            model_name: limiter.metrics() for model_name, limiter in limiters.items()
+        }
+
+
+_client_registry = None
+
+
+def get_client_registry():
+    """Get the client registry, installing the default one on first use."""
+    global _client_registry
+    if _client_registry is None:
+        set_client_registry(ClientRegistry())
+    return _client_registry
+
+
+def set_client_registry(registry):
+    """Install a client registry, e.g. with fake clients for tests."""
+    global _client_registry
+    registry.install()
+    _client_registry = registry
+
+
+def get_llm(model_name=DEFAULT_CHAT_MODEL, **kwargs):
+    """Get the shared chat model client of a model."""
+    return get_client_registry().get_llm(model_name, **kwargs)
+
+
+def get_embeddings(backend="openai", cache_path=None):
+    """Get the shared embedding client of a backend."""
+    return get_client_registry().get_embeddings(backend, cache_path)
+
+
+def get_model_limiter(model_name):
+    """Get the rate limiter shared by every request to a model."""
+    return get_client_registry().get_model_limiter(model_name)
+
+
+def set_rate_limits(requests_per_minute=None, tokens_per_minute=None, model_name=None):
+    """Set the quota of a model, or the default quota if model_name is None."""
+    get_client_registry().set_rate_limits(
+        requests_per_minute, tokens_per_minute, model_name
+    )
+
+
+def get_rate_limit_metrics():
+    """Get the queue depth and throttle events of the pipeline and of each model."""
+    metrics = get_client_registry().rate_limit_metrics()
+    metrics["pipeline"] = get_rate_limiter().metrics()
+    return metrics
+
+
+@asynccontextmanager
+async def pooled_async_session(pool_size=HTTP_POOL_SIZE):
+    """Share one aiohttp session across the async OpenAI requests of this task.
+
+    Tasks created inside the block inherit the session, instead of the OpenAI
+    client opening a new session for every request.
+    """
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
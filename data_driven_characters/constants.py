@@ -1,2 +1,5 @@
 DATA_ROOT = "data"
-VERBOSE = True
+OUTPUT_ROOT = "output"
+VERBOSE = False
+LLM_CACHE_PATH = "output/llm_cache.sqlite"
+EMBEDDING_CACHE_PATH = "output/embedding_cache.sqlite"
@@ -0,0 +1,105 @@
+import numpy as np
+
+from data_driven_characters.utils import count_tokens
+
+
+def search_with_ids(vectorstore, embedding, k):
+    """Search a FAISS vectorstore, returning (document, distance, id) triples.
+
+    Each id is the position of the document's vector in the index, to get the
+    vector later with reconstruct_vectors.
+    """
+    if hasattr(vectorstore, "search_with_ids"):
+        # e.g. a HierarchicalVectorStore
+        return vectorstore.search_with_ids(embedding, k)
+    index = vectorstore.index
+    if index.ntotal == 0:
+        return []
+    distances, ids = index.search(
+        np.array([embedding], dtype=np.float32), min(k, index.ntotal)
+    )
+    candidates = []
+    for distance, i in zip(distances[0], ids[0]):
+        if i == -1:
+            continue
+        document = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        candidates.append((document, float(distance), int(i)))
+    return candidates
+
+
+def reconstruct_vectors(vectorstore, ids):
+    """Get the vectors of a FAISS vectorstore at the ids of search_with_ids."""
+    if hasattr(vectorstore, "reconstruct_vectors"):
+        return vectorstore.reconstruct_vectors(ids)
+    return [vectorstore.index.reconstruct(i) for i in ids]
+
+
+def search_with_vectors(vectorstore, embedding, k):
+    """Search a FAISS vectorstore, returning (document, distance, vector) triples."""
+    if hasattr(vectorstore, "search_with_vectors"):
+        return vectorstore.search_with_vectors(embedding, k)
+    candidates = search_with_ids(vectorstore, embedding, k)
+    vectors = reconstruct_vectors(vectorstore, [i for _, _, i in candidates])
+    return [
+        (document, distance, vector)
+        for (document, distance, _), vector in zip(candidates, vectors)
+    ]
+
+
+def mmr_order(query_embedding, vectors, lambda_mult):
+    """Order vectors by maximal marginal relevance to the query."""
+    vectors = np.array(vectors, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-10
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    order = []
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    remaining = np.ones(len(vectors), dtype=bool)
+    while remaining.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~remaining] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+
+def assemble_context(
+    candidates, query_embedding, max_tokens, mmr_lambda=None, separator="\n"
+):
+    """Rank, dedupe and pack retrieved (document, distance, vector) candidates.
+
+    Candidates are ranked by distance, or by maximal marginal relevance if
+    mmr_lambda is set, so that near-duplicate overlapping chunks are pushed
+    down. Documents are then added in order while they fit in max_tokens.
+    """
+    candidates = sorted(candidates, key=lambda candidate: candidate[1])
+    seen = set()
+    unique = []
+    for candidate in candidates:
+        if candidate[0].page_content not in seen:
+            seen.add(candidate[0].page_content)
+            unique.append(candidate)
+    if mmr_lambda is not None and unique:
+        order = mmr_order(
+            query_embedding, [vector for _, _, vector in unique], mmr_lambda
+        )
+        unique = [unique[i] for i in order]
+
+    documents = []
+    num_tokens = 0
+    separator_tokens = count_tokens(separator)
+    for document, _, _ in unique:
+        document_tokens = count_tokens(document.page_content)
+        if documents:
+            document_tokens += separator_tokens
+        # keep going, a shorter document may still fit
+        if num_tokens + document_tokens > max_tokens:
+            continue
+        documents.append(document)
+        num_tokens += document_tokens
+    return documents
@@ -1,75 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
 
 from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
-from langchain.chains.summarize import load_summarize_chain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.chains.summarize import map_reduce_prompt, refine_prompts
 
+from data_driven_characters.chunking import TokenizedCorpus, iter_docs
+from data_driven_characters.clients import get_llm
 from data_driven_characters.constants import VERBOSE
+from data_driven_characters.llm_cache import cached_run
+from data_driven_characters.tracing import current_span, in_current_trace, traced
+from data_driven_characters.utils import batched, write_atomic
+
+SUMMARY_MAX_WORKERS = 8
+SUMMARY_BATCH_SIZE = 64
+SUMMARY_MANIFEST = "manifest.json"
 
 
 def generate_docs(corpus, chunk_size, chunk_overlap):
     """Generate docs from a corpus."""
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
-    )
-    docs = text_splitter.create_documents([corpus])
-    return docs
+    return TokenizedCorpus(corpus).docs(chunk_size, chunk_overlap)
 
 
 def load_docs(corpus_path, chunk_size, chunk_overlap):
-    """Load the corpus and split it into chunks."""
+    """Load the corpus and split it into chunks.
 
-    with open(corpus_path) as f:
-        corpus = f.read()
-    docs = generate_docs(corpus, chunk_size, chunk_overlap)
-    return docs
+    Use iter_docs to process the chunks one at a time, e.g. with
+    get_corpus_summaries, without holding them all in memory.
+    """
+    return list(iter_docs(corpus_path, chunk_size, chunk_overlap))
 
 
-def generate_corpus_summaries(docs, summary_type="map_reduce"):
-    """Generate summaries of the story."""
-    GPT3 = ChatOpenAI(model_name="gpt-3.5-turbo")
-    chain = load_summarize_chain(
-        GPT3, chain_type=summary_type, return_intermediate_steps=True, verbose=True
-    )
-    summary = chain({"input_documents": docs}, return_only_outputs=True)
-    intermediate_summaries = summary["intermediate_steps"]
-    return intermediate_summaries
-
-
-def get_corpus_summaries(docs, summary_type, cache_dir, force_refresh=False):
-    """Load the corpus summaries from cache or generate them."""
-    if not os.path.exists(cache_dir) or force_refresh:
-        os.makedirs(cache_dir, exist_ok=True)
-        if VERBOSE:
-            print("Summaries do not exist. Generating summaries.")
-        intermediate_summaries = generate_corpus_summaries(docs, summary_type)
-        for i, intermediate_summary in enumerate(intermediate_summaries):
-            with open(os.path.join(cache_dir, f"summary_{i}.txt"), "w") as f:
-                f.write(intermediate_summary)
+@traced("summarize_chunks")
+def generate_corpus_summaries(
+    docs,
+    summary_type="map_reduce",
+    llm=None,
+    max_workers=SUMMARY_MAX_WORKERS,
+    cached_summaries=None,
+    callback=None,
+    previous_summary=None,
+):
+    """Generate summaries of the story.
+
+    cached_summaries maps chunk indices to summaries that are already known, so
+    that only the remaining chunks are summarized. callback(i, summary) is
+    called as soon as the summary of chunk i is generated. For refine,
+    previous_summary is the summary of the chunks before docs, if any.
+    """
+    if llm is None:
+        llm = get_llm()
+    cached_summaries = cached_summaries or {}
+    summaries = [cached_summaries.get(i) for i in range(len(docs))]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    current_span().set(summary_type=summary_type, chunks=len(missing))
+
+    def summarize(i, chain, **inputs):
+        # the llm retries rate limit errors itself, under its model's limiter
+        summaries[i] = cached_run(chain, **inputs)
+        if callback is not None:
+            callback(i, summaries[i])
+
+    if summary_type == "map_reduce":
+        # only the per-chunk summaries of the map phase are kept, so the chunks
+        # are summarized concurrently and the reduce phase is skipped
+        chain = LLMChain(llm=llm, prompt=map_reduce_prompt.PROMPT, verbose=VERBOSE)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(
+                executor.map(
+                    in_current_trace(
+                        lambda i: summarize(i, chain, text=docs[i].page_content)
+                    ),
+                    missing,
+                )
+            )
+    elif summary_type == "refine":
+        # each summary refines the previous one, so this resumes from the first
+        # chunk without a summary
+        initial_chain = LLMChain(llm=llm, prompt=refine_prompts.PROMPT, verbose=VERBOSE)
+        refine_chain = LLMChain(
+            llm=llm, prompt=refine_prompts.REFINE_PROMPT, verbose=VERBOSE
+        )
+        for i in missing:
+            existing_answer = summaries[i - 1] if i > 0 else previous_summary
+            if existing_answer is None:
+                summarize(i, initial_chain, text=docs[i].page_content)
+            else:
+                summarize(
+                    i,
+                    refine_chain,
+                    existing_answer=existing_answer,
+                    text=docs[i].page_content,
+                )
     else:
-        if VERBOSE:
-            print("Summaries already exist. Loading summaries.")
-        intermediate_summaries = []
-        for i in range(len(os.listdir(cache_dir))):
-            with open(os.path.join(cache_dir, f"summary_{i}.txt")) as f:
-                intermediate_summaries.append(f.read())
-    return intermediate_summaries
+        raise ValueError(f"Unknown summary type: {summary_type}")
+    return summaries
+
+
+def get_summary_keys(docs, summary_type, model_name, previous_key=""):
+    """Get a content-addressed cache key for the summary of each chunk.
+
+    A refine summary depends on every chunk before it, so its key is chained
+    with the key of the previous summary.
+    """
+    keys = []
+    for doc in docs:
+        key = hashlib.sha256(
+            json.dumps(
+                {
+                    "text": doc.page_content,
+                    "summary_type": summary_type,
+                    "model_name": model_name,
+                    "previous_key": previous_key if summary_type == "refine" else "",
+                }
+            ).encode()
+        ).hexdigest()[:16]
+        keys.append(key)
+        previous_key = key
+    return keys
+
 
+def load_summary_manifest(cache_dir):
+    """Load the key -> filename index of a summaries directory.
 
+    The summary_{i}.txt files of directories written before the manifest
+    existed are not adopted: they were generated from the chunks of the old
+    text splitter, not from the chunks their keys would address.
+    """
+    manifest_path = os.path.join(cache_dir, SUMMARY_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)["files"]
+
+
+@traced("summarization")
+def get_corpus_summaries(
+    docs,
+    summary_type,
+    cache_dir,
+    force_refresh=False,
+    llm=None,
+    batch_size=SUMMARY_BATCH_SIZE,
+):
+    """Load the corpus summaries from cache or generate the missing ones.
+
+    docs can be any iterable of chunks, such as iter_docs, and is consumed
+    batch_size chunks at a time.
+    """
+    if llm is None:
+        llm = get_llm()
+    os.makedirs(cache_dir, exist_ok=True)
+    model_name = getattr(llm, "model_name", type(llm).__name__)
+    files = {} if force_refresh else load_summary_manifest(cache_dir)
+
+    summaries = []
+    keys = []
+    num_cached = 0
+    for batch in batched(docs, batch_size):
+        batch_keys = get_summary_keys(
+            batch, summary_type, model_name, keys[-1] if keys else ""
+        )
+        cached_summaries = {}
+        for j, key in enumerate(batch_keys):
+            filename = files.get(key, f"summary_{key}.txt")
+            path = os.path.join(cache_dir, filename)
+            if not force_refresh and os.path.exists(path):
+                with open(path) as f:
+                    cached_summaries[j] = f.read()
+                files[key] = filename
+        num_cached += len(cached_summaries)
+
+        def save_summary(j, summary, batch_keys=batch_keys):
+            # content-addressed, so partially completed runs can resume
+            write_atomic(
+                os.path.join(cache_dir, f"summary_{batch_keys[j]}.txt"), summary
+            )
+
+        summaries += generate_corpus_summaries(
+            batch,
+            summary_type,
+            llm=llm,
+            cached_summaries=cached_summaries,
+            callback=save_summary,
+            previous_summary=summaries[-1] if summaries else None,
+        )
+        keys += batch_keys
+
+    current_span().set(summary_type=summary_type, chunks=len(keys))
+    current_span().add(cache_hits=num_cached)
+    if VERBOSE:
+        print(
+            f"Loaded {num_cached} of {len(keys)} summaries from cache. "
+            f"Generated {len(keys) - num_cached} summaries."
+        )
+    for key in keys:
+        files.setdefault(key, f"summary_{key}.txt")
+    write_atomic(
+        os.path.join(cache_dir, SUMMARY_MANIFEST),
+        json.dumps(
+            {
+                "summary_type": summary_type,
+                "model_name": model_name,
+                "keys": keys,
+                "files": files,
+            },
+            indent=4,
+        ),
+    )
+    return summaries
+
+
+@traced("character_extraction")
 def generate_characters(corpus_summaries, num_characters):
     """Get a list of characters from a list of summaries."""
-    GPT4 = ChatOpenAI(model_name="gpt-4")
+    GPT4 = get_llm("gpt-4")
     characters_prompt_template = """Consider the following corpus.
     ---
     {corpus_summaries}
     ---
     Give a line-separated list of all the characters, ordered by importance, without punctuation.
     """
-    characters = LLMChain(
-        llm=GPT4, prompt=PromptTemplate.from_template(characters_prompt_template)
-    ).run(corpus_summaries="\n\n".join(corpus_summaries))
+    characters = cached_run(
+        LLMChain(
+            llm=GPT4, prompt=PromptTemplate.from_template(characters_prompt_template)
+        ),
+        corpus_summaries="\n\n".join(corpus_summaries),
+    )
     # remove (, ), and " for each element of list
     return characters.split("\n")[:num_characters]
 
@@ -78,8 +236,7 @@ def get_characters(corpus_summaries, num_characters, cache_dir, force_refresh=Fa
     cache_file = os.path.join(cache_dir, "characters.json")
     if not os.path.exists(cache_file) or force_refresh:
         characters = generate_characters(corpus_summaries, num_characters)
-        with open(cache_file, "w") as f:
-            json.dump(characters, f)
+        write_atomic(cache_file, json.dumps(characters))
     else:
         with open(cache_file, "r") as f:
             characters = json.load(f)
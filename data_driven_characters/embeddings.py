@@ -0,0 +1,223 @@
+from functools import lru_cache
+import hashlib
+import json
+import re
+import time
+
+import numpy as np
+
+from langchain.embeddings.base import Embeddings
+
+from data_driven_characters.llm_cache import SQLiteResponseCache
+from data_driven_characters.query_cache import CacheStats, LRUCache, normalize_query
+from data_driven_characters.tracing import record
+from data_driven_characters.utils import call_with_backoff, estimate_tokens
+
+EMBEDDING_BACKENDS = ["openai", "hashing", "huggingface"]
+HASHING_DIM = 1024
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+HUGGINGFACE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_SIZE = 100_000
+EMBEDDING_CACHE_BATCH_SIZE = 128
+PERSISTENT_QUERY_CACHE_SIZE = 10_000
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def _hash_feature(feature, dimension):
+    """Hash a feature to a bucket and a sign."""
+    h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+    return h % dimension, 1.0 if h >> 63 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """Embed texts on the CPU by hashing their words and word pairs into buckets.
+
+    There is no model to download and no network call, so indexing and
+    retrieval work offline. Matching is lexical rather than semantic.
+    """
+
+    def __init__(self, dimension=HASHING_DIM):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def _embed(self, text):
+        words = WORD_PATTERN.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if features:
+            buckets, signs = zip(
+                *(_hash_feature(feature, self.dimension) for feature in features)
+            )
+            np.add.at(vector, list(buckets), signs)
+            vector /= np.linalg.norm(vector) + 1e-10
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Cache the embeddings of another embedding model.
+
+    The most recent embeddings are kept in memory and, with a persistent
+    ResponseCache, on disk as well. Queries are cached by their normalized
+    text, so repeated or trivially different messages are embedded once across
+    every session. Only queries are persisted, since the documents of a
+    corpus are cached with its index. Texts that are not cached are embedded in batches of
+    batch_size. The model and dimension of the wrapped embeddings are passed
+    through, so cached indexes keep their keys.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_entries=EMBEDDING_CACHE_SIZE,
+        batch_size=EMBEDDING_CACHE_BATCH_SIZE,
+        persistent_cache=None,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.cache = LRUCache(max_entries)
+        self.persistent_cache = persistent_cache
+        self.stats = CacheStats()  # of queries
+        self.document_stats = CacheStats()
+
+    @property
+    def model(self):
+        return getattr(
+            self.embeddings,
+            "model",
+            getattr(self.embeddings, "model_name", type(self.embeddings).__name__),
+        )
+
+    @property
+    def dimension(self):
+        return getattr(self.embeddings, "dimension", None)
+
+    def _persistent_key(self, key):
+        return hashlib.sha256(json.dumps([self.model, *key]).encode()).hexdigest()
+
+    def _get(self, key, persist=False):
+        vector = self.cache.get(key)
+        if vector is None and persist and self.persistent_cache is not None:
+            response = self.persistent_cache.get(self._persistent_key(key))
+            if response is not None:
+                vector = json.loads(response)
+                self.cache.set(key, vector)
+        return vector
+
+    def _set(self, key, vector, persist=False):
+        self.cache.set(key, vector)
+        if persist and self.persistent_cache is not None:
+            self.persistent_cache.set(self._persistent_key(key), json.dumps(vector))
+
+    def embed_documents(self, texts):
+        vectors = [self._get(("document", text)) for text in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        self.document_stats.hit(len(texts) - len(missing))
+        record(cache_hits=len(texts) - len(missing), cache_misses=len(missing))
+        embedded = {}
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i : i + self.batch_size]
+            start = time.perf_counter()
+            batch_vectors = self.embeddings.embed_documents(batch)
+            self.document_stats.miss(time.perf_counter() - start, len(batch))
+            for text, vector in zip(batch, batch_vectors):
+                embedded[text] = vector
+                self._set(("document", text), vector)
+        return [
+            embedded[text] if vector is None else vector
+            for text, vector in zip(texts, vectors)
+        ]
+
+    def embed_query(self, text):
+        key = ("query", normalize_query(text))
+        vector = self._get(key, persist=True)
+        if vector is None:
+            start = time.perf_counter()
+            vector = self.embeddings.embed_query(text)
+            self.stats.miss(time.perf_counter() - start)
+            self._set(key, vector, persist=True)
+            record(cache_misses=1)
+        else:
+            self.stats.hit()
+            record(cache_hits=1)
+        return vector
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Make every request of another embedding model wait for a rate limiter.
+
+    Rate limit and other transient errors are retried here with backoff, so the
+    wrapped model should not retry them itself, or the limiter would never see
+    them.
+    """
+
+    def __init__(self, embeddings, limiter, max_retries=6):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    @property
+    def model(self):
+        return self.embeddings.model
+
+    @property
+    def dimension(self):
+        return getattr(self.embeddings, "dimension", None)
+
+    def _call(self, fn, texts):
+        tokens = sum(estimate_tokens(text) for text in texts)
+
+        def call():
+            with self.limiter.limit(tokens):
+                return fn()
+
+        return call_with_backoff(call, max_retries=self.max_retries)
+
+    def embed_documents(self, texts):
+        return self._call(lambda: self.embeddings.embed_documents(texts), texts)
+
+    def embed_query(self, text):
+        return self._call(lambda: self.embeddings.embed_query(text), [text])
+
+
+def get_embeddings(backend="openai", cache=True, cache_path=None, limiter=None):
+    """Get an embedding model by backend name, cached in memory by default.
+
+    openai calls the OpenAI API, hashing runs offline with no dependencies and
+    huggingface runs a local sentence-transformers model, which must be
+    installed separately. With cache_path, embeddings are also cached in a
+    SQLite database there. With a RateLimiter, every request to the OpenAI API
+    waits for it.
+    """
+    if backend == "openai":
+        from langchain.embeddings.openai import OpenAIEmbeddings
+
+        if limiter is None:
+            embeddings = OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL)
+        else:
+            embeddings = RateLimitedEmbeddings(
+                OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL, max_retries=0),
+                limiter,
+            )
+    elif backend == "hashing":
+        embeddings = HashingEmbeddings()
+    elif backend == "huggingface":
+        from langchain.embeddings import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name=HUGGINGFACE_MODEL)
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if not cache:
+        return embeddings
+    persistent_cache = None
+    if cache_path is not None:
+        persistent_cache = SQLiteResponseCache(
+            cache_path, max_entries=PERSISTENT_QUERY_CACHE_SIZE
+        )
+    return CachedEmbeddings(embeddings, persistent_cache=persistent_cache)
@@ -0,0 +1,131 @@
+from typing import List
+
+import numpy as np
+
+from langchain.schema import Document
+
+from data_driven_characters.index import load_corpus_vectorstore
+
+NUM_PARENTS = 3
+
+
+def get_children(parent_docs, child_docs):
+    """Map each parent chunk to the indices of the child chunks centered in it.
+
+    Both lists of chunks must carry start_char and end_char metadata, as the
+    chunks of a TokenizedCorpus do.
+    """
+    starts = np.array([doc.metadata["start_char"] for doc in parent_docs])
+    children = [[] for _ in parent_docs]
+    for i, doc in enumerate(child_docs):
+        middle = (doc.metadata["start_char"] + doc.metadata["end_char"]) // 2
+        parent = max(int(np.searchsorted(starts, middle, side="right")) - 1, 0)
+        children[parent].append(i)
+    return children
+
+
+class HierarchicalVectorStore:
+    """Search the summaries of large chunks, then the small chunks under the best ones.
+
+    summary_vectorstore holds one summary per parent chunk and
+    chunk_vectorstore the child chunks, in order. Only the children of the
+    num_parents nearest summaries are compared to the query, instead of every
+    child chunk of the corpus.
+
+    It is read-only, so it is not a langchain VectorStore, but it can be used
+    as the corpus_vectorstore of ConversationVectorStoreRetrieverMemory.
+    """
+
+    def __init__(
+        self, summary_vectorstore, chunk_vectorstore, children, num_parents=NUM_PARENTS
+    ):
+        self.summary_vectorstore = summary_vectorstore
+        self.chunk_vectorstore = chunk_vectorstore
+        self.children = children
+        self.num_parents = num_parents
+        self.embedding_function = chunk_vectorstore.embedding_function
+        versions = [
+            getattr(summary_vectorstore, "index_version", None),
+            getattr(chunk_vectorstore, "index_version", None),
+        ]
+        self.index_version = (
+            None if None in versions else f"{versions[0]}-{versions[1]}-{num_parents}"
+        )
+
+    def _search(self, embedding, k):
+        """Return the k nearest child chunks as (document, distance, id, vector)."""
+        query = np.array([embedding], dtype=np.float32)
+        summary_index = self.summary_vectorstore.index
+        if summary_index.ntotal == 0:
+            return []
+        _, parents = summary_index.search(
+            query, min(self.num_parents, summary_index.ntotal)
+        )
+        ids = [
+            child
+            for parent in parents[0]
+            if parent != -1
+            for child in self.children[parent]
+        ]
+        if not ids:
+            return []
+        vectors = self.reconstruct_vectors(ids)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        candidates = []
+        for j in np.argsort(distances)[:k]:
+            document = self.chunk_vectorstore.docstore.search(
+                self.chunk_vectorstore.index_to_docstore_id[ids[j]]
+            )
+            candidates.append((document, float(distances[j]), ids[j], vectors[j]))
+        return candidates
+
+    def search_with_vectors(self, embedding, k):
+        """Return the k nearest child chunks as (document, distance, vector) triples."""
+        return [
+            (document, distance, vector)
+            for document, distance, _, vector in self._search(embedding, k)
+        ]
+
+    def search_with_ids(self, embedding, k):
+        """Return the k nearest child chunks as (document, distance, id) triples."""
+        return [
+            (document, distance, i)
+            for document, distance, i, _ in self._search(embedding, k)
+        ]
+
+    def reconstruct_vectors(self, ids):
+        """Get the vectors of the child chunks at the ids of search_with_ids."""
+        chunk_index = self.chunk_vectorstore.index
+        return np.vstack([chunk_index.reconstruct(i) for i in ids])
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        embedding = self.embedding_function(query)
+        return [document for document, _, _ in self.search_with_vectors(embedding, k)]
+
+
+def get_hierarchical_vectorstore(
+    summaries,
+    parent_docs,
+    child_docs,
+    embeddings,
+    cache_dir=None,
+    num_parents=NUM_PARENTS,
+    index_type="flat",
+):
+    """Get a read-only two-level vectorstore over the summaries and child chunks.
+
+    summaries[i] is the summary of parent_docs[i], as returned by
+    get_corpus_summaries. Both levels are cached like load_corpus_vectorstore.
+    """
+    summary_vectorstore = load_corpus_vectorstore(
+        summaries, embeddings, cache_dir, index_type
+    )
+    chunk_vectorstore = load_corpus_vectorstore(
+        [doc.page_content for doc in child_docs], embeddings, cache_dir, index_type
+    )
+    return HierarchicalVectorStore(
+        summary_vectorstore,
+        chunk_vectorstore,
+        get_children(parent_docs, child_docs),
+        num_parents,
+    )
@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import math
+import os
+import pickle
+import shutil
+
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+from langchain.docstore import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from data_driven_characters.constants import VERBOSE
+
+EMBEDDING_DIM = 1536  # Dimensions of the OpenAIEmbeddings
+EMBEDDING_DIMS = {"text-embedding-ada-002": EMBEDDING_DIM}
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+EMBEDDING_BATCH_SIZE = 128
+EMBEDDING_MAX_WORKERS = 4
+INDEX_TYPES = ["flat", "ivf", "hnsw", "pq"]
+MIN_TRAINING_VECTORS = 1024  # below this, trained indexes fall back to flat
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+PQ_SUBVECTOR_DIM = 16
+
+
+def format_documents(documents):
+    """Format documents the way ConversationVectorStoreRetrieverMemory stores them."""
+    return [f"[{i}]: {document}" for i, document in enumerate(documents)]
+
+
+def get_embedding_dim(embeddings):
+    """Get the dimension of the vectors of an embedding model."""
+    dim = getattr(embeddings, "dimension", None)
+    if dim is None:
+        dim = EMBEDDING_DIMS.get(getattr(embeddings, "model", None))
+    if dim is None:
+        dim = len(embeddings.embed_query("dimension"))
+    return dim
+
+
+def get_index_description(index_type, dim, num_vectors):
+    """Get the faiss.index_factory description of an index type for a corpus size.
+
+    flat is an exact scan, ivf scans the IVF_NPROBE nearest of ~4*sqrt(n)
+    clusters, hnsw walks a graph and pq compresses every vector to one byte per
+    PQ_SUBVECTOR_DIM dimensions. ivf and pq need training, so they fall back to
+    flat below MIN_TRAINING_VECTORS vectors.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if index_type in ("ivf", "pq") and num_vectors < MIN_TRAINING_VECTORS:
+        index_type = "flat"
+    if index_type == "flat":
+        return "Flat"
+    elif index_type == "ivf":
+        # at least 39 training vectors per cluster
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        return f"IVF{nlist},Flat"
+    elif index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    else:
+        m = max(1, dim // PQ_SUBVECTOR_DIM)
+        while dim % m:
+            m -= 1
+        nbits = min(8, int(math.log2(num_vectors // 39)))
+        return f"PQ{m}x{nbits}"
+
+
+def tune_index(index):
+    """Set the search-time parameters of approximate indexes."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def create_index(index_type, dim, vectors=None):
+    """Create a FAISS index, trained on vectors if the index type needs it."""
+    num_vectors = 0 if vectors is None else len(vectors)
+    index = faiss.index_factory(
+        dim, get_index_description(index_type, dim, num_vectors)
+    )
+    if not index.is_trained:
+        index.train(vectors)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # context assembly reconstructs the vectors of search results
+        ivf.make_direct_map()
+    return tune_index(index)
+
+
+def get_index_key(documents, embeddings, index_type="flat"):
+    """Hash the documents, the embedding model and the index type into a cache key.
+
+    The documents are the chunks (or chunk summaries) of the corpus, so the key
+    changes whenever the corpus content or the chunking parameters change.
+    """
+    embedding_model = getattr(embeddings, "model", type(embeddings).__name__)
+    h = hashlib.sha256()
+    params = {"embedding_model": embedding_model}
+    if index_type != "flat":
+        # flat indexes keep the keys they were cached under
+        params["index_type"] = index_type
+    h.update(json.dumps(params).encode())
+    for document in documents:
+        h.update(hashlib.sha256(document.encode()).digest())
+    return h.hexdigest()[:16]
+
+
+def embed_texts(
+    texts,
+    embeddings,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_workers=EMBEDDING_MAX_WORKERS,
+):
+    """Embed texts in batches, with up to max_workers batches in flight."""
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            tqdm(
+                executor.map(embeddings.embed_documents, batches),
+                total=len(batches),
+                disable=not VERBOSE,
+            )
+        )
+    return [vector for batch in results for vector in batch]
+
+
+def build_vectorstore(
+    documents,
+    embeddings,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_workers=EMBEDDING_MAX_WORKERS,
+    index_type="flat",
+):
+    """Embed the documents into a new FAISS vectorstore."""
+    texts = format_documents(documents)
+    if not texts:
+        return FAISS(
+            embeddings.embed_query,
+            create_index("flat", get_embedding_dim(embeddings)),
+            InMemoryDocstore({}),
+            {},
+        )
+    vectors = embed_texts(texts, embeddings, batch_size, max_workers)
+    vectorstore = FAISS(
+        embeddings.embed_query,
+        create_index(index_type, len(vectors[0]), np.array(vectors, dtype=np.float32)),
+        InMemoryDocstore({}),
+        {},
+    )
+    # a single add to the FAISS index
+    vectorstore.add_embeddings(list(zip(texts, vectors)))
+    return vectorstore
+
+
+def save_vectorstore(vectorstore, path):
+    """Save the FAISS index and docstore of a vectorstore to a directory."""
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    faiss.write_index(vectorstore.index, os.path.join(tmp_path, INDEX_FILE))
+    with open(os.path.join(tmp_path, DOCSTORE_FILE), "wb") as f:
+        pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+    # swap the directory in only once it is complete
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_vectorstore(path, embeddings, mmap=False):
+    """Load a vectorstore saved with save_vectorstore.
+
+    With mmap=True the index is memory-mapped instead of read into memory, in
+    which case it must be treated as read-only. IO_FLAG_MMAP_IFC maps the codes
+    of every index type in place, while IO_FLAG_MMAP only maps IVF lists and
+    would read flat and HNSW indexes into memory.
+    """
+    io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = tune_index(faiss.read_index(os.path.join(path, INDEX_FILE), io_flags))
+    with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+
+def get_vectorstore(
+    documents,
+    embeddings,
+    cache_dir,
+    force_refresh=False,
+    mmap=False,
+    index_type="flat",
+):
+    """Load the vectorstore of the documents from cache or build it."""
+    path = os.path.join(cache_dir, get_index_key(documents, embeddings, index_type))
+    if not os.path.exists(path) or force_refresh:
+        if VERBOSE:
+            print("Index does not exist. Embedding documents.")
+        vectorstore = build_vectorstore(documents, embeddings, index_type=index_type)
+        save_vectorstore(vectorstore, path)
+    else:
+        if VERBOSE:
+            print("Index already exists. Loading index.")
+        vectorstore = load_vectorstore(path, embeddings, mmap=mmap)
+    return vectorstore
+
+
+def load_corpus_vectorstore(documents, embeddings, cache_dir=None, index_type="flat"):
+    """Get a read-only vectorstore of the documents to share across conversations.
+
+    Its index_version identifies its content, e.g. to cache search results.
+    """
+    if cache_dir is None:
+        vectorstore = build_vectorstore(documents, embeddings, index_type=index_type)
+    else:
+        vectorstore = get_vectorstore(
+            documents, embeddings, cache_dir, mmap=True, index_type=index_type
+        )
+    vectorstore.index_version = get_index_key(documents, embeddings, index_type)
+    return vectorstore
@@ -1,2 +1,3 @@
 from .commandline_ui import CommandLine
 from .streamlit_ui import Streamlit, reset_chat, clear_user_input, converse
+from .server import Server
@@ -7,6 +7,7 @@ class CommandLine:
         while True:
             text = input("You: ")
             if text:
-                print(
-                    f"{self.chatbot.character_definition.name}: {self.chatbot.step(text)}"
-                )
+                print(f"{self.chatbot.character_definition.name}: ", end="", flush=True)
+                for token in self.chatbot.stream_step(text):
+                    print(token, end="", flush=True)
+                print()
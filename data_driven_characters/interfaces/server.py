@@ -0,0 +1,112 @@
+import asyncio
+from http import HTTPStatus
+import json
+import uuid
+
+from data_driven_characters.clients import get_rate_limit_metrics, pooled_async_session
+
+
+class Server:
+    """A minimal asyncio JSON-over-HTTP server with one chatbot per session.
+
+    Endpoints:
+        POST   /sessions                   -> {"session_id", "greeting"}
+        POST   /sessions/<id>/messages     {"input"} -> {"response"}
+        GET    /sessions/<id>/stats        -> cache hit rates of the chatbot
+        GET    /rate_limits                -> queue depth and throttle events
+        DELETE /sessions/<id>              -> {}
+    """
+
+    def __init__(self, create_chatbot, host="127.0.0.1", port=8000):
+        self.create_chatbot = create_chatbot
+        self.host = host
+        self.port = port
+        self.sessions = {}
+        self.locks = {}
+
+    async def create_session(self):
+        # building a chatbot may load the retrieval index from disk
+        chatbot = await asyncio.to_thread(self.create_chatbot)
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = chatbot
+        self.locks[session_id] = asyncio.Lock()
+        return {"session_id": session_id, "greeting": chatbot.greet()}
+
+    async def send_message(self, session_id, text):
+        chatbot = self.sessions[session_id]
+        # turns within a session are sequential, turns across sessions are not
+        async with self.locks[session_id]:
+            response = await chatbot.astep(text)
+        return {"response": response}
+
+    def get_stats(self, session_id):
+        chatbot = self.sessions[session_id]
+        return chatbot.cache_stats() if hasattr(chatbot, "cache_stats") else {}
+
+    def delete_session(self, session_id):
+        del self.sessions[session_id]
+        del self.locks[session_id]
+        return {}
+
+    async def route(self, method, path, body):
+        parts = path.strip("/").split("/")
+        if method == "POST" and parts == ["sessions"]:
+            return HTTPStatus.CREATED, await self.create_session()
+        if (
+            method == "POST"
+            and len(parts) == 3
+            and parts[::2] == ["sessions", "messages"]
+        ):
+            if "input" not in body:
+                raise ValueError("Missing input")
+            return HTTPStatus.OK, await self.send_message(parts[1], body["input"])
+        if method == "GET" and len(parts) == 3 and parts[::2] == ["sessions", "stats"]:
+            return HTTPStatus.OK, self.get_stats(parts[1])
+        if method == "GET" and parts == ["rate_limits"]:
+            return HTTPStatus.OK, get_rate_limit_metrics()
+        if method == "DELETE" and len(parts) == 2 and parts[0] == "sessions":
+            return HTTPStatus.OK, self.delete_session(parts[1])
+        return HTTPStatus.NOT_FOUND, {"error": f"Unknown route: {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            content_length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode().partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = int(value)
+            body = await reader.readexactly(content_length)
+            status, payload = await self.route(
+                method, path, json.loads(body) if body else {}
+            )
+        except KeyError as e:
+            status, payload = HTTPStatus.NOT_FOUND, {"error": f"Unknown key: {e}"}
+        except ValueError as e:
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def serve(self):
+        # connections are handled in the context the server is started in, so
+        # the pooled session must be set first for the handlers to see it
+        async with pooled_async_session():
+            server = await asyncio.start_server(
+                self.handle_connection, self.host, self.port
+            )
+            print(f"Serving on http://{self.host}:{self.port}")
+            async with server:
+                await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
@@ -3,9 +3,9 @@ from streamlit_chat import message
 
 
 def reset_chat():
-    st.cache_resource.clear()
-    if "messages" in st.session_state:
-        del st.session_state["messages"]
+    for key in ["chatbot", "messages"]:
+        if key in st.session_state:
+            del st.session_state[key]
 
 
 def clear_user_input():
@@ -49,8 +49,14 @@ def converse(chatbot):
             }
         )
         message(user_input, is_user=True, key=key)
+        # render the reply as it streams in, then replace it with a chat message
+        placeholder = st.empty()
+        response = ""
         with st.spinner(f"{chatbot.character_definition.name} is thinking..."):
-            response = chatbot.step(user_input)
+            for token in chatbot.stream_step(user_input):
+                response += token
+                placeholder.markdown(response + "▌")
+        placeholder.empty()
         key = len(st.session_state.messages)
         st.session_state.messages.append(
             {
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from data_driven_characters.constants import LLM_CACHE_PATH
+from data_driven_characters.rate_limit import get_rate_limiter
+from data_driven_characters.tracing import record
+from data_driven_characters.utils import estimate_tokens
+
+# evict this fraction of max_entries at a time, so most inserts evict nothing
+EVICTION_BATCH_FRACTION = 0.1
+
+
+class ResponseCache(ABC):
+    """Interface of a cache of LLM responses."""
+
+    @abstractmethod
+    def get(self, key):
+        """Get the cached response of a key, or None."""
+
+    @abstractmethod
+    def set(self, key, response):
+        """Cache the response of a key."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every cached response."""
+
+
+class InMemoryResponseCache(ResponseCache):
+    """A cache of LLM responses in a dict, for tests and benchmarks."""
+
+    def __init__(self):
+        self.responses = {}
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def set(self, key, response):
+        self.responses[key] = response
+
+    def clear(self):
+        self.responses.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """A cache of LLM responses in a SQLite database.
+
+    Entries older than ttl seconds are treated as misses. Once there are more
+    than max_entries entries, the least recently used ones are evicted, along
+    with EVICTION_BATCH_FRACTION of max_entries more to make room for the next
+    inserts.
+    """
+
+    def __init__(self, database_path, ttl=None, max_entries=100_000):
+        self.database_path = database_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(database_path) or ".", exist_ok=True)
+        with self.connect() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+            # an upper bound, as other processes may share the database
+            (self.num_entries,) = connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+
+    @contextmanager
+    def connect(self):
+        """Open a connection for a single transaction."""
+        connection = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.connect() as connection:
+            row = connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            return response
+
+    def set(self, key, response):
+        now = time.time()
+        with self.lock, self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self.num_entries += 1
+            if self.num_entries > self.max_entries:
+                self._evict(connection)
+
+    def _evict(self, connection):
+        """Evict the least recently used entries once there are too many."""
+        (self.num_entries,) = connection.execute(
+            "SELECT COUNT(*) FROM responses"
+        ).fetchone()
+        if self.num_entries <= self.max_entries:
+            return
+        num_evicted = self.num_entries - self.max_entries
+        num_evicted += int(self.max_entries * EVICTION_BATCH_FRACTION)
+        connection.execute(
+            """DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed LIMIT ?
+            )""",
+            (num_evicted,),
+        )
+        self.num_entries = max(0, self.num_entries - num_evicted)
+
+    def clear(self):
+        with self.lock, self.connect() as connection:
+            connection.execute("DELETE FROM responses")
+            self.num_entries = 0
+
+
+_DEFAULT = object()
+_response_cache = _DEFAULT
+
+
+def get_response_cache():
+    """Get the response cache, opening the default SQLite cache on first use."""
+    global _response_cache
+    if _response_cache is _DEFAULT:
+        _response_cache = SQLiteResponseCache(LLM_CACHE_PATH)
+    return _response_cache
+
+
+def set_response_cache(cache):
+    """Set the response cache, or disable caching with None."""
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_key(llm, prompt, salt=""):
+    """Hash the model, its parameters and the prompt into a cache key."""
+    params = getattr(llm, "_identifying_params", {})
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "llm": type(llm).__name__,
+                "params": params,
+                "prompt": prompt,
+                "salt": salt,
+            },
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+def cached_run(chain, salt="", **inputs):
+    """Run an LLMChain, returning the cached response for an identical prompt.
+
+    salt distinguishes calls that should not share a response despite having
+    the same prompt. Chains without a prompt and llm are run uncached. Cache
+    misses wait for the shared rate limiter.
+    """
+
+    def run(tokens=0):
+        with get_rate_limiter().limit(tokens):
+            return chain.run(**inputs)
+
+    if not hasattr(chain, "prompt") or not hasattr(chain, "llm"):
+        return run()
+    prompt = chain.prompt.format_prompt(**inputs).to_string()
+    cache = get_response_cache()
+    if cache is None:
+        return run(estimate_tokens(prompt))
+    key = get_response_key(chain.llm, prompt, salt)
+    response = cache.get(key)
+    if response is None:
+        record(cache_misses=1)
+        response = run(estimate_tokens(prompt))
+        cache.set(key, response)
+    else:
+        record(cache_hits=1)
+    return response
@@ -1 +1,3 @@
+from .conversation import BoundedConversationMemory, create_conversation_memory
 from .retrieval import ConversationVectorStoreRetrieverMemory
+from .write_behind import TurnWriter
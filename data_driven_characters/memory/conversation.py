@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Any, Dict, List, Optional
+
+from pydantic import PrivateAttr
+
+from langchain import LLMChain
+from langchain.base_language import BaseLanguageModel
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.memory.utils import get_prompt_input_key
+from langchain.schema import BaseMessage, SystemMessage, get_buffer_string
+
+from data_driven_characters.clients import get_llm
+from data_driven_characters.utils import count_tokens, trim_tokens
+
+
+class BoundedConversationMemory(ConversationBufferMemory):
+    """Conversation memory that never exceeds max_token_limit tokens.
+
+    The most recent turns are kept verbatim. Turns that no longer fit are
+    folded into a running summary in a background thread, so summarizing
+    never blocks a reply. summary_token_limit tokens of the budget are
+    reserved for the summary.
+
+    If max_prompt_tokens is set, the history is also trimmed so that the whole
+    prompt fits in it: prompt_token_overhead tokens are the rest of the prompt,
+    such as the persona, greeting and retrieved context, and the input of each
+    turn is counted when the history is loaded.
+    """
+
+    llm: BaseLanguageModel
+    max_token_limit: int = 1000
+    summary_token_limit: int = 250
+    max_prompt_tokens: Optional[int] = None
+    prompt_token_overhead: int = 0
+    summary: str = ""
+
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _executor: Any = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(max_workers=1)
+    )
+    _future: Any = PrivateAttr(default=None)
+
+    def _buffer_string(self, messages: List[BaseMessage]) -> str:
+        return get_buffer_string(
+            messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+        )
+
+    @property
+    def buffer(self) -> Any:
+        """String buffer of memory."""
+        with self._lock:
+            messages = list(self.chat_memory.messages)
+            if self.summary:
+                messages.insert(0, SystemMessage(content=self.summary))
+        if self.return_messages:
+            return messages
+        return self._buffer_string(messages)
+
+    def _evict(self, input_tokens: int = 0) -> None:
+        """Move the oldest turns to the summary until the verbatim turns fit."""
+        buffer_token_limit = self.max_token_limit - self.summary_token_limit
+        if self.max_prompt_tokens is not None:
+            buffer_token_limit = min(
+                buffer_token_limit,
+                self.max_prompt_tokens
+                - self.prompt_token_overhead
+                - self.summary_token_limit
+                - input_tokens,
+            )
+        with self._lock:
+            messages = self.chat_memory.messages
+            while messages and (
+                count_tokens(self._buffer_string(messages)) > buffer_token_limit
+            ):
+                self._pending.append(messages.pop(0))
+            if self._pending and self._future is None:
+                self._future = self._executor.submit(self._summarize_pending)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return history buffer, leaving room for the input in the prompt."""
+        if self.max_prompt_tokens is not None:
+            input_key = self.input_key or get_prompt_input_key(
+                inputs, self.memory_variables
+            )
+            self._evict(count_tokens(inputs.get(input_key, "")))
+        return super().load_memory_variables(inputs)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save context from this conversation to buffer, evicting old turns."""
+        super().save_context(inputs, outputs)
+        self._evict()
+
+    def _summarize_pending(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._future = None
+                    return
+                pending, self._pending = self._pending, []
+                summary = self.summary
+            try:
+                summary = LLMChain(llm=self.llm, prompt=SUMMARY_PROMPT).run(
+                    summary=summary, new_lines=self._buffer_string(pending)
+                )
+            except Exception:
+                # keep the turns so that the next save_context retries them
+                with self._lock:
+                    self._pending[:0] = pending
+                    self._future = None
+                raise
+            with self._lock:
+                self.summary = trim_tokens(summary.strip(), self.summary_token_limit)
+
+    def flush(self) -> None:
+        """Wait until every evicted turn has been summarized."""
+        while (future := self._future) is not None:
+            future.result()
+
+    def clear(self) -> None:
+        """Clear memory contents."""
+        self.flush()
+        super().clear()
+        self.summary = ""
+
+
+def create_conversation_memory(
+    memory_key,
+    input_key,
+    max_token_limit=None,
+    max_prompt_tokens=None,
+    prompt_token_overhead=0,
+):
+    """Create an unbounded buffer memory, or a bounded one if a token limit is set.
+
+    max_token_limit bounds the history, and max_prompt_tokens the whole prompt,
+    of which prompt_token_overhead tokens are neither history nor input.
+    """
+    if max_token_limit is None and max_prompt_tokens is None:
+        return ConversationBufferMemory(memory_key=memory_key, input_key=input_key)
+    history_token_limit = max_token_limit
+    if max_prompt_tokens is not None:
+        if max_prompt_tokens <= prompt_token_overhead:
+            raise ValueError(
+                f"max_prompt_tokens={max_prompt_tokens} leaves no room for the "
+                f"history after the {prompt_token_overhead} tokens of the rest of "
+                "the prompt"
+            )
+        history_token_limit = min(
+            history_token_limit or max_prompt_tokens,
+            max_prompt_tokens - prompt_token_overhead,
+        )
+    return BoundedConversationMemory(
+        llm=get_llm(),
+        max_token_limit=history_token_limit,
+        summary_token_limit=history_token_limit // 4,
+        max_prompt_tokens=max_prompt_tokens,
+        prompt_token_overhead=prompt_token_overhead,
+        memory_key=memory_key,
+        input_key=input_key,
+    )
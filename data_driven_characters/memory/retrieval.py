@@ -1,13 +1,69 @@
-from typing import Any, List, Dict
+import time
+from typing import Any, List, Dict, Optional, Union
+
+from pydantic import PrivateAttr
+
 from langchain.memory import VectorStoreRetrieverMemory
 
 from langchain.schema import Document
 
+from data_driven_characters.context import (
+    assemble_context,
+    reconstruct_vectors,
+    search_with_ids,
+    search_with_vectors,
+)
+from data_driven_characters.query_cache import CacheStats, LRUCache, normalize_query
+from data_driven_characters.tracing import current_span, record, traced
+from data_driven_characters.utils import estimate_tokens
+
+TURN_RESULTS_CACHE_SIZE = 128
+# each entry holds up to fetch_k (document, distance, id) triples, not vectors
+CORPUS_RESULTS_CACHE_SIZE = 1024
+
+# nearest corpus documents by (index version, normalized query, k), shared by
+# every conversation since corpus vectorstores are read-only
+corpus_results = LRUCache(CORPUS_RESULTS_CACHE_SIZE)
+corpus_results_stats = CacheStats()
+
+
+def search(vectorstore, embedding, k, keep_vectors=True):
+    """Search like search_with_vectors, dropping the vectors unless kept."""
+    candidates = search_with_vectors(vectorstore, embedding, k)
+    if keep_vectors:
+        return candidates
+    return [(document, distance, None) for document, distance, _ in candidates]
+
 
 class ConversationVectorStoreRetrieverMemory(VectorStoreRetrieverMemory):
     input_prefix = "Human"
     output_prefix = "AI"
     blacklist = []  # keys to ignore
+    # read-only documents shared across conversations, in a FAISS vectorstore
+    # or a HierarchicalVectorStore; turns go to the retriever
+    corpus_vectorstore: Optional[Any] = None
+    # if set, pack up to fetch_k candidates into this many tokens instead of top-k
+    max_context_tokens: Optional[int] = None
+    fetch_k: int = 32
+    mmr_lambda: Optional[float] = None
+    # if set, turns are embedded and indexed in the background by this TurnWriter
+    turn_writer: Optional[Any] = None
+
+    # turns submitted to the turn writer, with their documents
+    _pending_writes: List[Any] = PrivateAttr(default_factory=list)
+    # nearest turns by (normalized query, k, vectors), cleared whenever a turn is saved
+    _turn_results: Any = PrivateAttr(
+        default_factory=lambda: LRUCache(TURN_RESULTS_CACHE_SIZE)
+    )
+    _turn_results_stats: Any = PrivateAttr(default_factory=CacheStats)
+
+    @property
+    def turn_results_stats(self) -> CacheStats:
+        return self._turn_results_stats
+
+    @property
+    def corpus_results_stats(self) -> CacheStats:
+        return corpus_results_stats
 
     def _form_documents(
         self, inputs: Dict[str, Any], outputs: Dict[str, str]
@@ -28,3 +84,132 @@ class ConversationVectorStoreRetrieverMemory(VectorStoreRetrieverMemory):
             texts.append(f"{k}: {v}")
         page_content = "\n".join(texts)
         return [Document(page_content=page_content)]
+
+    @traced("retrieval")
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        """Get the documents of the corpus and this conversation to put in context.
+
+        The nearest corpus documents are cached across conversations, and the
+        nearest turns until the next turn is saved, so only the turns are
+        searched again after a save.
+        """
+        key = normalize_query(query)
+        embedding = self.retriever.vectorstore.embedding_function(query)
+        keep_vectors = (
+            self.max_context_tokens is not None and self.mmr_lambda is not None
+        )
+        if self.max_context_tokens is None:
+            k = self.retriever.search_kwargs.get("k", 4)
+        else:
+            k = self.fetch_k
+        candidates = self._search_turns(key, embedding, k, keep_vectors)
+        if self.corpus_vectorstore is not None:
+            candidates = candidates + self._search_corpus(
+                key, embedding, k, keep_vectors
+            )
+
+        if self.max_context_tokens is None:
+            # a single top-k by L2 distance over the turns and the corpus
+            candidates = sorted(candidates, key=lambda candidate: candidate[1])
+            documents = [document for document, _, _ in candidates[:k]]
+        else:
+            documents = assemble_context(
+                candidates, embedding, self.max_context_tokens, self.mmr_lambda
+            )
+        current_span().set(
+            documents=len(documents),
+            tokens=sum(
+                estimate_tokens(document.page_content) for document in documents
+            ),
+        )
+        return documents
+
+    def _search_turns(self, key, embedding, k, keep_vectors):
+        """Get the k nearest turns of this conversation, searched again after a save."""
+        cache_key = (key, k, keep_vectors)
+        candidates = self._turn_results.get(cache_key)
+        if candidates is not None:
+            self._turn_results_stats.hit()
+            record(cache_hits=1)
+            return candidates
+        start = time.perf_counter()
+        # the previous turns must be searchable (read-your-writes)
+        self.flush()
+        candidates = search(self.retriever.vectorstore, embedding, k, keep_vectors)
+        self._turn_results_stats.miss(time.perf_counter() - start)
+        record(cache_misses=1)
+        self._turn_results.set(cache_key, candidates)
+        return candidates
+
+    def _search_corpus(self, key, embedding, k, keep_vectors):
+        """Get the k nearest corpus documents, cached across conversations.
+
+        Only the ids of the documents' vectors are cached, and the vectors are
+        reconstructed from the index when kept, so that the cache stays small.
+        """
+        version = getattr(self.corpus_vectorstore, "index_version", None)
+        if version is None:
+            # no way to tell whether cached results are still valid
+            return search(self.corpus_vectorstore, embedding, k, keep_vectors)
+        cache_key = (version, key, k)
+        candidates = corpus_results.get(cache_key)
+        if candidates is not None:
+            corpus_results_stats.hit()
+            record(cache_hits=1)
+        else:
+            start = time.perf_counter()
+            candidates = search_with_ids(self.corpus_vectorstore, embedding, k)
+            corpus_results_stats.miss(time.perf_counter() - start)
+            record(cache_misses=1)
+            corpus_results.set(cache_key, candidates)
+        if keep_vectors:
+            vectors = reconstruct_vectors(
+                self.corpus_vectorstore, [i for _, _, i in candidates]
+            )
+        else:
+            vectors = [None] * len(candidates)
+        return [
+            (document, distance, vector)
+            for (document, distance, _), vector in zip(candidates, vectors)
+        ]
+
+    def flush(self) -> None:
+        """Wait until every turn submitted to the turn writer is indexed.
+
+        Turns that failed to index in the background are indexed here instead.
+        """
+        pending_writes, self._pending_writes = self._pending_writes, []
+        if pending_writes and self.turn_writer is not None:
+            self.turn_writer.flush()
+        for future, documents in pending_writes:
+            if future.exception() is not None:
+                self.retriever.add_documents(documents)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save context from this conversation to the index."""
+        if self.turn_writer is None:
+            super().save_context(inputs, outputs)
+        else:
+            documents = self._form_documents(inputs, outputs)
+            future = self.turn_writer.submit(
+                self.retriever.vectorstore,
+                [document.page_content for document in documents],
+                [document.metadata for document in documents],
+            )
+            self._pending_writes.append((future, documents))
+        self._turn_results.clear()
+
+    def clear(self) -> None:
+        self.flush()
+        super().clear()
+        self._turn_results.clear()
+
+    def load_memory_variables(
+        self, inputs: Dict[str, Any]
+    ) -> Dict[str, Union[List[Document], str]]:
+        """Return history buffer."""
+        input_key = self._get_prompt_input_key(inputs)
+        docs = self._get_relevant_documents(inputs[input_key])
+        if self.return_docs:
+            return {self.memory_key: docs}
+        return {self.memory_key: "\n".join(doc.page_content for doc in docs)}
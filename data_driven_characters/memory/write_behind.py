@@ -0,0 +1,99 @@
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+
+TURN_WRITER_BATCH_SIZE = 64
+TURN_WRITER_MAX_DELAY = 0.05  # seconds to wait for more turns to batch
+TURN_WRITER_IDLE_TIMEOUT = 5.0  # seconds before an idle worker thread exits
+
+
+class TurnWriter:
+    """Embed and index conversation turns in a background thread.
+
+    Turns submitted within max_delay of each other, from any number of
+    vectorstores, are embedded with one embed_documents call and then added to
+    their vectorstores, unless a reader calls flush to have them indexed now.
+    The worker thread exits when idle and restarts on the next submit, so a
+    writer per conversation does not leak threads.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size=TURN_WRITER_BATCH_SIZE,
+        max_delay=TURN_WRITER_MAX_DELAY,
+        idle_timeout=TURN_WRITER_IDLE_TIMEOUT,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.idle_timeout = idle_timeout
+        self.queue = deque()
+        # set by flush to stop waiting for more turns to batch
+        self.flushing = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def submit(self, vectorstore, texts, metadatas=None):
+        """Queue texts to be added to a FAISS vectorstore, returning a Future."""
+        future = Future()
+        with self.condition:
+            self.queue.append((vectorstore, texts, metadatas, future))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return future
+
+    def flush(self):
+        """Index the queued turns without waiting for more turns to batch."""
+        with self.condition:
+            if self.queue:
+                self.flushing = True
+                self.condition.notify()
+
+    def _next_batch(self):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue, self.idle_timeout):
+                self.thread = None
+                return None
+        # give concurrent conversations a moment to add their turns
+        deadline = time.monotonic() + self.max_delay
+        with self.condition:
+            while len(self.queue) < self.batch_size and not self.flushing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [
+                self.queue.popleft()
+                for _ in range(min(self.batch_size, len(self.queue)))
+            ]
+            if not self.queue:
+                self.flushing = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            texts = [text for _, item_texts, _, _ in batch for text in item_texts]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            i = 0
+            for vectorstore, item_texts, metadatas, future in batch:
+                item_vectors = vectors[i : i + len(item_texts)]
+                i += len(item_texts)
+                try:
+                    vectorstore.add_embeddings(
+                        list(zip(item_texts, item_vectors)), metadatas
+                    )
+                    future.set_result(None)
+                except Exception as e:
+                    future.set_exception(e)
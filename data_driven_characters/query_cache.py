@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import threading
+
+
+def normalize_query(text):
+    """Normalize a query so that trivially different messages share cache entries."""
+    return " ".join(text.lower().split())
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counts of a cache, and the time spent computing misses."""
+
+    hits: int = 0
+    misses: int = 0
+    miss_seconds: float = 0.0
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def hit(self, count=1):
+        with self.lock:
+            self.hits += count
+
+    def miss(self, seconds, count=1):
+        with self.lock:
+            self.misses += count
+            self.miss_seconds += seconds
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def saved_seconds(self):
+        """Estimated time saved by hits, at the mean cost of a miss."""
+        return self.hits * self.miss_seconds / self.misses if self.misses else 0.0
+
+    def as_dict(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hit_rate,
+            miss_seconds=self.miss_seconds,
+            saved_seconds=self.saved_seconds,
+        )
+
+
+class LRUCache:
+    """A thread-safe dict that evicts the least recently used entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,317 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+import threading
+import time
+
+from data_driven_characters.utils import is_rate_limit_error
+
+AIMD_DECREASE_FACTOR = 0.5
+# after a cut, no request starts for this many average request latencies
+THROTTLE_PAUSE_LATENCIES = 2
+LATENCY_SMOOTHING = 0.1  # weight of each request in the average latency
+BUCKET_BURST_SECONDS = 1.0  # of budget that may be spent at once
+
+
+class TokenBucket:
+    """A budget of units per minute, refilled continuously.
+
+    The bucket holds BUCKET_BURST_SECONDS of budget, so that a minute's quota
+    is spread over the minute instead of being spent in one burst.
+    Reservations are taken immediately and may overdraw the bucket, so that
+    callers wait in the order they reserved instead of racing for the refill.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = None
+        if per_minute is not None:
+            self.capacity = max(1, per_minute * BUCKET_BURST_SECONDS / 60)
+        self.level = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Reserve amount units, returning the seconds to wait before using them."""
+        if self.per_minute is None or amount <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(
+                self.capacity,
+                self.level + (now - self.last_refill) * self.per_minute / 60,
+            )
+            self.last_refill = now
+            # a request larger than a minute's budget waits for a minute
+            self.level -= min(amount, self.per_minute)
+            return max(0.0, -self.level * 60 / self.per_minute)
+
+    def refund(self, amount):
+        """Return unused units, or take more with a negative amount."""
+        if self.per_minute is None:
+            return
+        with self.lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass
+class RateLimiterStats:
+    """Queue depth, throughput and throttle events of a rate limiter."""
+
+    in_flight: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    requests: int = 0
+    tokens: int = 0
+    throttle_events: int = 0
+    wait_seconds: float = 0.0
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def as_dict(self):
+        return dict(
+            in_flight=self.in_flight,
+            queue_depth=self.queue_depth,
+            max_queue_depth=self.max_queue_depth,
+            requests=self.requests,
+            tokens=self.tokens,
+            throttle_events=self.throttle_events,
+            wait_seconds=self.wait_seconds,
+        )
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """Limit concurrent requests, requests per minute and tokens per minute.
+
+    With adaptive=True the concurrency limit is controlled AIMD-style: it grows
+    by one slot per limit's worth of successful requests, up to
+    max_concurrency, and is cut by AIMD_DECREASE_FACTOR on a rate limit error,
+    down to min_concurrency. Errors of requests that started before the last
+    cut do not cut it again, so a burst of 429s halves the limit once. After a
+    cut, no request starts for THROTTLE_PAUSE_LATENCIES average request
+    latencies, so that the requests waiting for a slot do not run into the
+    same exhausted quota one after another.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        adaptive=False,
+        min_concurrency=1,
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.adaptive = adaptive
+        self.concurrency_limit = float(max_concurrency)
+        self.last_decrease = float("-inf")
+        self.paused_until = float("-inf")
+        self.mean_latency = None  # of successful requests
+        self.condition = threading.Condition()
+        # (loop, future) of each coroutine waiting for a slot
+        self.async_waiters = []
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.stats = RateLimiterStats()
+
+    def acquire(self, tokens=0):
+        """Wait for a request slot and the budget of one request of tokens.
+
+        Returns the time the request started, to pass to release.
+        """
+        start = time.monotonic()
+        self._enqueue()
+        try:
+            with self.condition:
+                self.condition.wait_for(self._take_slot)
+            try:
+                time.sleep(self._reserve(tokens))
+            except BaseException:
+                self._release_slot()
+                raise
+        finally:
+            self._dequeue()
+        return self._start(start, tokens)
+
+    async def aacquire(self, tokens=0):
+        """Like acquire, but wait in the event loop instead of blocking a thread.
+
+        A coroutine cancelled while it waits for a slot does not take one, and
+        one cancelled while it waits for the budget gives its slot back.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self._enqueue()
+        try:
+            while True:
+                with self.condition:
+                    if self._take_slot():
+                        break
+                    waiter = loop.create_future()
+                    self.async_waiters.append((loop, waiter))
+                try:
+                    await waiter
+                except BaseException:
+                    with self.condition:
+                        if (loop, waiter) in self.async_waiters:
+                            self.async_waiters.remove((loop, waiter))
+                    raise
+            try:
+                await asyncio.sleep(self._reserve(tokens))
+            except BaseException:
+                self._release_slot()
+                raise
+        finally:
+            self._dequeue()
+        return self._start(start, tokens)
+
+    def _enqueue(self):
+        with self.stats.lock:
+            self.stats.queue_depth += 1
+            self.stats.max_queue_depth = max(
+                self.stats.max_queue_depth, self.stats.queue_depth
+            )
+
+    def _dequeue(self):
+        with self.stats.lock:
+            self.stats.queue_depth -= 1
+
+    def _take_slot(self):
+        """Take a request slot if one is free; call with the condition held."""
+        if self.stats.in_flight >= int(self.concurrency_limit):
+            return False
+        with self.stats.lock:
+            self.stats.in_flight += 1
+        return True
+
+    def _reserve(self, tokens):
+        """Reserve the budget of one request, returning the seconds to wait for it."""
+        return max(
+            self.request_bucket.reserve(1),
+            self.token_bucket.reserve(tokens),
+            self.paused_until - time.monotonic(),
+        )
+
+    def _start(self, start, tokens):
+        started = time.monotonic()
+        with self.stats.lock:
+            self.stats.requests += 1
+            self.stats.tokens += tokens
+            self.stats.wait_seconds += started - start
+        return started
+
+    def _wake_async_waiters(self):
+        """Wake every coroutine waiting for a slot to check for one again.
+
+        Call with the condition held.
+        """
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_done, waiter)
+            except RuntimeError:
+                pass  # its loop is closed
+
+    def _release_slot(self):
+        with self.condition:
+            with self.stats.lock:
+                self.stats.in_flight -= 1
+            self.condition.notify()
+            self._wake_async_waiters()
+
+    def release(self, started=None, error=None):
+        """Release a request slot, adapting the concurrency limit to its outcome."""
+        with self.condition:
+            if error is not None and is_rate_limit_error(error):
+                with self.stats.lock:
+                    self.stats.throttle_events += 1
+                if self.adaptive and (started is None or started > self.last_decrease):
+                    self.concurrency_limit = max(
+                        self.min_concurrency,
+                        self.concurrency_limit * AIMD_DECREASE_FACTOR,
+                    )
+                    self.last_decrease = time.monotonic()
+                    self.paused_until = (
+                        self.last_decrease
+                        + THROTTLE_PAUSE_LATENCIES * (self.mean_latency or 0.0)
+                    )
+            elif error is None and self.adaptive:
+                if started is not None:
+                    latency = time.monotonic() - started
+                    if self.mean_latency is None:
+                        self.mean_latency = latency
+                    self.mean_latency += LATENCY_SMOOTHING * (
+                        latency - self.mean_latency
+                    )
+                self.concurrency_limit = min(
+                    self.max_concurrency,
+                    self.concurrency_limit + 1 / self.concurrency_limit,
+                )
+            with self.stats.lock:
+                self.stats.in_flight -= 1
+            self.condition.notify_all()
+            self._wake_async_waiters()
+
+    def set_quota(self, requests_per_minute=None, tokens_per_minute=None):
+        """Replace the requests per minute and tokens per minute of the limiter."""
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+    def record_tokens(self, reserved, used):
+        """Correct the token budget once the actual usage of a request is known."""
+        with self.stats.lock:
+            self.stats.tokens += used - reserved
+        self.token_bucket.refund(reserved - used)
+
+    def metrics(self):
+        """Get the queue depth, throttle events and current concurrency limit."""
+        metrics = self.stats.as_dict()
+        metrics["concurrency_limit"] = int(self.concurrency_limit)
+        return metrics
+
+    @contextmanager
+    def limit(self, tokens=0):
+        """Hold a request slot for the duration of the block."""
+        started = self.acquire(tokens)
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    @asynccontextmanager
+    async def alimit(self, tokens=0):
+        """Hold a request slot for the duration of the block, without blocking the loop."""
+        started = await self.aacquire(tokens)
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    """Get the rate limiter shared by every LLM call of the pipeline."""
+    return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter):
+    """Replace the rate limiter shared by every LLM call of the pipeline."""
+    global _rate_limiter
+    _rate_limiter = rate_limiter
@@ -0,0 +1,345 @@
+"""Structured tracing of the pipeline and chat stages.
+
+Each stage runs in a span that records its wall time and attributes. The
+counters tokens_in, tokens_out, cache_hits and cache_misses are added to the
+span and to every span it is nested in, so a stage accounts for the LLM calls
+and cache lookups it made. Spans are only created while an exporter is
+installed, so tracing costs nothing by default:
+    set_exporters([JSONLExporter("output/trace.jsonl")])
+    with stage("summarization", summary_type="map_reduce") as span:
+        ...
+        span.add(cache_hits=1)
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import functools
+import inspect
+import json
+import threading
+import time
+import uuid
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from data_driven_characters.utils import estimate_tokens
+
+COUNTERS = ["tokens_in", "tokens_out", "cache_hits", "cache_misses"]
+
+
+class Span:
+    """The wall time and attributes of one run of a stage."""
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_time = time.time()
+        self.seconds = None
+        self.error = None
+        self.attributes = dict.fromkeys(COUNTERS, 0)
+        self.attributes.update(attributes)
+        self.lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        """Set attributes of this span only."""
+        with self.lock:
+            self.attributes.update(attributes)
+
+    def add(self, **counts):
+        """Add to counters of this span and of every span it is nested in."""
+        span = self
+        while span is not None:
+            with span.lock:
+                for key, count in counts.items():
+                    span.attributes[key] = span.attributes.get(key, 0) + count
+            span = span.parent
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent.span_id if self.parent is not None else None,
+            start_time=self.start_time,
+            seconds=self.seconds,
+            error=self.error,
+            attributes=self.attributes,
+        )
+
+
+class _NullSpan:
+    """The span of a stage while tracing is off."""
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, **counts):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+_current_span = ContextVar("current_span", default=None)
+_exporters = []
+
+
+def get_exporters():
+    """Get the exporters that finished spans are sent to."""
+    return _exporters
+
+
+def set_exporters(exporters):
+    """Replace the exporters that finished spans are sent to, closing the old ones."""
+    global _exporters
+    old_exporters, _exporters = _exporters, list(exporters)
+    for exporter in old_exporters:
+        if exporter not in _exporters:
+            exporter.close()
+
+
+def current_span():
+    """Get the span of the innermost running stage, or a span that ignores updates."""
+    return _current_span.get() or NULL_SPAN
+
+
+def start_span(name, **attributes):
+    """Start a span nested in the current stage, without making it current."""
+    if not _exporters:
+        return NULL_SPAN
+    span = Span(name, parent=_current_span.get(), **attributes)
+    for exporter in _exporters:
+        exporter.on_start(span)
+    return span
+
+
+def end_span(span, error=None):
+    """Finish a span and send it to the exporters."""
+    if span is NULL_SPAN:
+        return
+    span.seconds = time.perf_counter() - span._start
+    if error is not None:
+        span.error = repr(error)
+    for exporter in _exporters:
+        exporter.on_end(span)
+
+
+@contextmanager
+def stage(name, **attributes):
+    """Run the block as a span of a stage, nested in the current stage."""
+    span = start_span(name, **attributes)
+    if span is NULL_SPAN:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        end_span(span, e)
+        raise
+    finally:
+        _current_span.reset(token)
+    end_span(span)
+
+
+def traced(name):
+    """Decorate a function or coroutine function to run as a stage."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(**counts):
+    """Add to counters of the current stage, such as cache_hits."""
+    span = _current_span.get()
+    if span is not None:
+        span.add(**counts)
+
+
+def in_current_trace(fn):
+    """Wrap fn to run in the current stage, e.g. when submitted to a thread pool."""
+    context = copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+class SpanExporter:
+    """Receives every span when it starts and when it ends."""
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONLExporter(SpanExporter):
+    """Append one JSON object per finished span to a file, or to stdout with '-'."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def on_end(self, span):
+        line = json.dumps(span.as_dict(), default=str) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a") if self.path != "-" else None
+            if self.file is None:
+                print(line, end="", flush=True)
+            else:
+                self.file.write(line)
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class OpenTelemetryExporter(SpanExporter):
+    """Mirror every span as an OpenTelemetry span.
+
+    opentelemetry-api must be installed, and a tracer provider configured with
+    opentelemetry-sdk for the spans to go anywhere.
+    """
+
+    def __init__(self, tracer_name="data_driven_characters"):
+        from opentelemetry import trace
+
+        self.trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def on_start(self, span):
+        with self.lock:
+            parent = self.spans.get(span.parent.span_id) if span.parent else None
+        context = self.trace.set_span_in_context(parent) if parent else None
+        otel_span = self.tracer.start_span(
+            span.name, context=context, start_time=int(span.start_time * 1e9)
+        )
+        with self.lock:
+            self.spans[span.span_id] = otel_span
+
+    def on_end(self, span):
+        with self.lock:
+            otel_span = self.spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        otel_span.set_attributes(
+            {
+                key: value
+                for key, value in span.attributes.items()
+                if isinstance(value, (bool, int, float, str))
+            }
+        )
+        if span.error is not None:
+            otel_span.set_status(
+                self.trace.Status(self.trace.StatusCode.ERROR, span.error)
+            )
+        otel_span.end(end_time=int((span.start_time + span.seconds) * 1e9))
+
+
+class StageTotals(SpanExporter):
+    """Sum the wall time and counters of every stage, to find where the time goes."""
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+
+    def on_end(self, span):
+        with self.lock:
+            totals = self.totals[span.name]
+            totals["count"] += 1
+            totals["seconds"] += span.seconds
+            for key in COUNTERS:
+                totals[key] += span.attributes.get(key, 0)
+
+    def as_dict(self):
+        with self.lock:
+            return {name: dict(totals) for name, totals in self.totals.items()}
+
+
+def create_exporters(trace_path=None, otel=False):
+    """Create the exporters selected on the command line."""
+    exporters = []
+    if trace_path is not None:
+        exporters.append(JSONLExporter(trace_path))
+    if otel:
+        exporters.append(OpenTelemetryExporter())
+    return exporters
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Record every LLM call as an llm_call span of the current stage.
+
+    Token counts come from the usage reported by the model, or are estimated
+    from the prompts and generations if it reports none.
+    """
+
+    # handle async events in the calling task, so spans nest in its stage
+    run_inline = True
+
+    def __init__(self):
+        self.spans = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        span = start_span(
+            "llm_call", model=params.get("model_name") or params.get("_type")
+        )
+        if span is not NULL_SPAN:
+            tokens_in = sum(estimate_tokens(prompt) for prompt in prompts)
+            self.spans[run_id] = (span, tokens_in)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span, tokens_in = self.spans.pop(run_id, (None, 0))
+        if span is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if "prompt_tokens" in usage:
+            tokens_in = usage["prompt_tokens"]
+            tokens_out = usage.get("completion_tokens", 0)
+        else:
+            tokens_out = sum(
+                estimate_tokens(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+        span.add(tokens_in=tokens_in, tokens_out=tokens_out)
+        end_span(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span, _ = self.spans.pop(run_id, (None, 0))
+        if span is not None:
+            end_span(span, error)
+
+
+tracing_callback_handler = TracingCallbackHandler()
@@ -1,4 +1,17 @@
+import asyncio
+from functools import lru_cache
+from itertools import islice
 import math
+import os
+import random
+import threading
+import time
+
+import tiktoken
+
+# the default encoding of RecursiveCharacterTextSplitter.from_tiktoken_encoder
+TOKEN_ENCODING = "gpt2"
+CHARS_PER_TOKEN = 4  # typical for English text
 
 
 def apply_file_naming_convention(text):
@@ -7,9 +20,115 @@ def apply_file_naming_convention(text):
     return text.replace('"', "-").replace(" ", "_")
 
 
+def write_atomic(path, text):
+    """Write text to a file so that readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def batched(iterable, n):
+    """Yield successive lists of n elements of an iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
 def order_of_magnitude(number):
     """Return the order of magnitude of a number."""
     if number == 0:
         return 0
     else:
         return math.floor(math.log10(abs(number)))
+
+
+def is_rate_limit_error(error):
+    """Return whether an exception is a rate limit (HTTP 429) error."""
+    return (
+        type(error).__name__ == "RateLimitError"
+        or getattr(error, "http_status", None) == 429
+        or getattr(error, "status_code", None) == 429
+    )
+
+
+# the transient errors ChatOpenAI and OpenAIEmbeddings retry, besides rate limits
+TRANSIENT_ERRORS = {
+    "Timeout",
+    "APIError",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+}
+
+
+def is_transient_error(error):
+    """Return whether an exception is a rate limit, timeout or server error."""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    return (
+        is_rate_limit_error(error)
+        or type(error).__name__ in TRANSIENT_ERRORS
+        or (isinstance(status, int) and status >= 500)
+    )
+
+
+def call_with_backoff(fn, *args, max_retries=6, initial_delay=1.0, **kwargs):
+    """Call fn, retrying with jittered exponential backoff on transient errors."""
+    delay = initial_delay
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries or not is_transient_error(e):
+                raise
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+
+async def acall_with_backoff(fn, *args, max_retries=6, initial_delay=1.0, **kwargs):
+    """Await fn, retrying with jittered exponential backoff on transient errors."""
+    delay = initial_delay
+    for attempt in range(max_retries + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries or not is_transient_error(e):
+                raise
+            await asyncio.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name=TOKEN_ENCODING):
+    """Get a tiktoken encoder, loading it only once."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text):
+    """Count the tokens in a string."""
+    return len(get_encoder().encode(text))
+
+
+def estimate_tokens(text):
+    """Estimate the tokens in a string without tokenizing it, for rate limiting."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_words(text, max_chars):
+    """Cut a string to at most max_chars characters, at a word boundary if possible."""
+    if len(text) <= max_chars:
+        return text
+    truncated = text[:max_chars]
+    if not text[max_chars].isspace():
+        # drop the word that was cut, unless it is the only one
+        words = truncated.rsplit(None, 1)
+        if len(words) > 1:
+            truncated = words[0]
+    return truncated.rstrip(" ,;:-")
+
+
+def trim_tokens(text, max_tokens):
+    """Trim a string to at most max_tokens tokens."""
+    tokens = get_encoder().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoder().decode(tokens[:max_tokens])
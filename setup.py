@@ -9,9 +9,15 @@ setup(
         'langchain',
         'loguru',
         'notebook',
+        'numpy',
         'openai',
         'streamlit_chat',
         'tiktoken',
         'tqdm',
     ],
+    entry_points={
+        'console_scripts': [
+            'data_driven_characters=data_driven_characters.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from data_driven_characters.chunking import TokenizedCorpus, iter_docs
+
+CORPUS_PATH = os.path.join(
+    os.path.dirname(__file__), os.pardir, "data", "top_gun_maverick.txt"
+)
+
+
+@pytest.fixture(params=["\n", "\r\n"], ids=["lf", "crlf"])
+def corpus_path(request, tmp_path):
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        text = f.read()
+    path = tmp_path / "corpus.txt"
+    path.write_bytes(text.replace("\n", request.param).encode())
+    return path
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(2048, 64), (256, 16)])
+@pytest.mark.parametrize("block_size", [4096, 1 << 20])
+def test_iter_docs_matches_tokenized_corpus(
+    corpus_path, chunk_size, chunk_overlap, block_size
+):
+    docs = TokenizedCorpus.from_file(corpus_path).docs(chunk_size, chunk_overlap)
+    assert len(docs) > 1
+    assert (
+        list(iter_docs(corpus_path, chunk_size, chunk_overlap, block_size=block_size))
+        == docs
+    )
+
+
+def test_byte_offsets(corpus_path):
+    data = corpus_path.read_bytes()
+    for doc in TokenizedCorpus.from_file(corpus_path).docs(256, 16):
+        start, end = doc.metadata["start_byte"], doc.metadata["end_byte"]
+        assert data[start:end].decode().strip() == doc.page_content